@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Compare tvfetch.read_torrent against a full bencodepy.decode of the same
+.torrent data. Requires bencodepy (pip install bencodepy).
+
+    python benchmarks/bench_bencode.py [--files N] [--size MB]
+"""
+import hashlib
+import os
+import sys
+import timeit
+import tracemalloc
+from argparse import ArgumentParser
+
+import bencodepy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import tvfetch  # noqa: E402
+
+
+def make_torrent(num_files, total_size, piece_length=262144):
+    num_pieces = total_size // piece_length + 1
+    info = {
+        b'name': b'Some.Show.S01.720p.HDTV',
+        b'piece length': piece_length,
+        b'pieces': os.urandom(20 * num_pieces),
+        b'files': [
+            {b'length': total_size // num_files,
+             b'path': [b'Some.Show.S01E%02d.720p.HDTV.mkv' % (i + 1)]}
+            for i in range(num_files)
+        ],
+    }
+    return bencodepy.encode({
+        b'announce': b'http://tracker.example.com/announce',
+        b'info': info,
+    })
+
+
+def full_decode(data):
+    torrent = bencodepy.decode(data)
+    info = torrent[b'info']
+    hashlib.sha1(bencodepy.encode(info)).hexdigest()
+    return info[b'name'], info[b'files']
+
+
+def peak_memory(func, data):
+    tracemalloc.start()
+    func(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=25,
+                        help="Number of files in the torrent")
+    parser.add_argument('--size', type=int, default=20000,
+                        help="Total size of the torrent's content in MB")
+    parser.add_argument('--number', type=int, default=50,
+                        help="Iterations per measurement")
+    options = parser.parse_args()
+
+    data = make_torrent(options.files, options.size * 1048576)
+    meta = tvfetch.read_torrent(data)
+    assert meta.infohash == hashlib.sha1(bencodepy.encode(
+        bencodepy.decode(data)[b'info'])).hexdigest()
+
+    print('torrent: %d bytes, %d files' % (len(data), len(meta.files)))
+    print('%-20s %12s %14s' % ('', 'ms/torrent', 'peak alloc KB'))
+    for label, func in (('bencodepy.decode', full_decode),
+                        ('read_torrent', tvfetch.read_torrent)):
+        seconds = timeit.timeit(lambda: func(data), number=options.number)
+        print('%-20s %12.3f %14.1f' % (
+            label, seconds / options.number * 1000,
+            peak_memory(func, data) / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+Benchmark find_new and check_progress end to end against local stand-ins
+for ezrss, TVDB and Transmission (see fakes.py).
+
+    python benchmarks/bench_cycle.py --shows 10 100 1000 10000
+
+Each size runs in its own process, against a fresh database. The first
+(cold) find_new fills max_concurrent, check_progress then runs until those
+torrents are done, and the second (warm) find_new adds the next episodes
+from cached TVDB data and feeds. Reports throughput, the mean and 95th
+percentile latency of each phase, and peak memory.
+"""
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import SUPPRESS, ArgumentParser
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import tvfetch  # noqa: E402
+from fakes import (FeedServer, StubTVDB, TransmissionServer,  # noqa: E402
+                   show_name)
+
+CONFIG = """\
+[daemon]
+db_path = %(work_dir)s/db.sqlite
+log_level = %(log_level)s
+
+[tvdb]
+api_key = benchmark
+
+[transmission]
+host = 127.0.0.1
+port = %(transmission_port)d
+
+[defaults]
+destination = %(work_dir)s/videos/%%(show_name)s/%%(season)s-%%(episode)s
+max_concurrent = %(max_concurrent)d
+"""
+
+
+def write_config(path, num_shows, **settings):
+    with open(path, 'w') as f:
+        f.write(CONFIG % settings)
+        for i in range(num_shows):
+            f.write('\n[%s]\n' % show_name(i))
+
+
+def percentile(buckets, counts, total, q):
+    # upper bound of the bucket holding the q-th quantile
+    for bound, count in zip(buckets, counts):
+        if count >= q * total:
+            return bound
+    return float('inf')
+
+
+def phase_stats(metrics):
+    # {phase: (count, mean seconds, p95 seconds)}, over all shows/methods
+    values, histograms = metrics.snapshot()
+    phases = {}
+    for (name, labels), hist in histograms.items():
+        labels = dict(labels)
+        key = labels.get('phase') or 'cycle:' + labels.get('cycle', '')
+        if labels.get('method'):
+            key += ':' + labels['method']
+        total = phases.setdefault(key, [0] * len(hist))
+        for i, value in enumerate(hist):
+            total[i] += value
+    result = {}
+    for key, hist in phases.items():
+        count = hist[-1]
+        result[key] = (count, hist[-2] / count if count else 0,
+                       percentile(metrics.BUCKETS, hist, count, 0.95))
+    return result
+
+
+def run(num_shows, options):
+    work_dir = tempfile.mkdtemp(prefix='tvfetch-bench-')
+    download_dir = os.path.join(work_dir, 'downloads')
+    os.makedirs(download_dir)
+    try:
+        feeds = FeedServer(options.seasons, options.episodes,
+                           options.variants).start()
+        transmission = TransmissionServer(download_dir).start()
+        StubTVDB.seasons = options.seasons
+        StubTVDB.episodes = options.episodes
+        tvfetch.tvdb_api.TVDB = StubTVDB
+        tvfetch.feed_url = feeds.url + '/search/'
+
+        config_path = os.path.join(work_dir, 'tvfetch.conf')
+        write_config(config_path, num_shows, work_dir=work_dir,
+                     log_level=options.log_level,
+                     transmission_port=transmission.server_address[1],
+                     max_concurrent=options.max_concurrent)
+        fetcher = tvfetch.TvFetch(config_path)
+
+        # new torrents are added to transmission from the outbox, as the
+        # daemon does after each check
+        start = time.monotonic()
+        fetcher.find_new()
+        fetcher.send_outbox()
+        cold = time.monotonic() - start
+        added_cold = transmission.calls.get('torrent-add', 0)
+
+        # poll until every torrent has been placed, seeded and removed, so
+        # that the warm pass has room under max_concurrent for new ones
+        start = time.monotonic()
+        ticks = 0
+        while fetcher.check_progress() and ticks < options.max_ticks:
+            ticks += 1
+            time.sleep(0.01)
+        progress = time.monotonic() - start
+
+        start = time.monotonic()
+        fetcher.find_new()
+        fetcher.send_outbox()
+        warm = time.monotonic() - start
+
+        return {
+            'shows': num_shows,
+            'find_new_cold': cold,
+            'find_new_warm': warm,
+            'check_progress': progress,
+            'ticks': ticks,
+            'added': transmission.calls.get('torrent-add', 0),
+            'added_cold': added_cold,
+            'rpc_calls': sum(transmission.calls.values()),
+            'peak_rss_mb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            'phases': phase_stats(fetcher.metrics),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def report(result):
+    shows = result['shows']
+    print('%d shows: %d torrents added, %d transmission calls, '
+          'peak RSS %.1f MB' % (shows, result['added'], result['rpc_calls'],
+                                result['peak_rss_mb']))
+    print('  find_new (cold)  %8.2fs  %8.1f shows/s  %6d added' % (
+        result['find_new_cold'], shows / result['find_new_cold'],
+        result['added_cold']))
+    print('  check_progress   %8.2fs  %8d ticks' % (
+        result['check_progress'], result['ticks']))
+    print('  find_new (warm)  %8.2fs  %8.1f shows/s  %6d added' % (
+        result['find_new_warm'], shows / result['find_new_warm'],
+        result['added'] - result['added_cold']))
+    print('  %-32s %8s %10s %10s' % ('phase', 'count', 'mean ms', 'p95 ms'))
+    for phase, (count, mean, p95) in sorted(result['phases'].items()):
+        print('  %-32s %8d %10.2f %10.2f' % (
+            phase, count, mean * 1000, p95 * 1000))
+    print('')
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--shows', type=int, nargs='+', default=[10, 100],
+                        help="Number of shows to benchmark with")
+    parser.add_argument('--seasons', type=int, default=3)
+    parser.add_argument('--episodes', type=int, default=10,
+                        help="Episodes per season")
+    parser.add_argument('--variants', type=int, default=2,
+                        help="Torrents offered per episode")
+    parser.add_argument('--max-concurrent', type=int, default=2)
+    parser.add_argument('--max-ticks', type=int, default=1000,
+                        help="Give up on check_progress after this many")
+    parser.add_argument('--log-level', default='warning')
+    parser.add_argument('--json', action='store_true',
+                        help="Print results as JSON lines")
+    parser.add_argument('--child', action='store_true',
+                        help=SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        # a single size, run by the parent process below
+        print(json.dumps(run(options.shows[0], options)))
+        return
+
+    for num_shows in options.shows:
+        args = sys.argv[1:] + ['--child', '--shows', str(num_shows)]
+        output = subprocess.check_output([sys.executable, __file__] + args)
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        if options.json:
+            print(json.dumps(result))
+        else:
+            report(result)
+
+
+if __name__ == '__main__':
+    main()
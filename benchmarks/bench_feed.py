@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+Compare tvfetch.read_feed against feedparser on large synthetic ezrss-style
+feeds, newest entries first, downloaded from a local HTTP server.
+
+    python benchmarks/bench_feed.py [--entries N ...] [--number N]
+
+The feed is downloaded whole and then parsed, the way tvfetch used to, and
+parsed while it is streamed in, both reading the whole feed and with the
+watermark halfway through, where the download stops at the first older
+entry. "KB read" is how much of the feed was downloaded.
+"""
+import email.utils
+import os
+import sys
+import threading
+import timeit
+import tracemalloc
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import tvfetch  # noqa: E402
+
+EPOCH = 1388534400  # 2014-01-01
+
+
+def make_feed(num_entries):
+    items = []
+    for i in range(num_entries, 0, -1):
+        season, episode = divmod(i, 100)
+        infohash = '%040x' % i
+        link = 'http://torrents.invalid/%d.torrent' % i
+        items.append(
+            '<item><title>Some Show S%02dE%02d 720p HDTV</title>'
+            '<link>%s</link><guid>%s</guid><pubDate>%s</pubDate>'
+            '<description>Show Name: Some Show; Episode Title: Episode %d; '
+            'Season: %d; Episode: %d</description>'
+            '<enclosure url="%s" length="1048576" '
+            'type="application/x-bittorrent"/>'
+            '<torrent:infoHash>%s</torrent:infoHash>'
+            '<torrent:magnetURI><![CDATA[magnet:?xt=urn:btih:%s]]>'
+            '</torrent:magnetURI></item>' % (
+                season, episode, link, link,
+                email.utils.formatdate(EPOCH + i * 3600, usegmt=True),
+                episode, season, episode, link, infohash, infohash))
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            '<rss version="2.0" xmlns:torrent="http://xmlns.ezrss.it/0.1/">'
+            '<channel><title>Some Show</title>%s</channel></rss>'
+            % ''.join(items)).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            BaseHTTPRequestHandler.handle(self)
+        except OSError:
+            # the client closed the connection before reading the feed
+            pass
+
+    def do_GET(self):
+        data = self.server.data
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        view = memoryview(data)
+        for start in range(0, len(data), 16384):
+            self.wfile.write(view[start:start + 16384])
+
+
+class FeedServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, data, address=('127.0.0.1', 0)):
+        ThreadingHTTPServer.__init__(self, address, _Handler)
+        self.data = data
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+
+class CountingReader(object):
+    # counts the bytes read from a file
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.count += len(data)
+        return data
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, nargs='+',
+                        default=[100, 1000, 10000],
+                        help="Number of entries in the feed")
+    parser.add_argument('--number', type=int, default=5,
+                        help="Iterations per measurement")
+    options = parser.parse_args()
+
+    http = tvfetch.HTTPPool()
+    for num_entries in options.entries:
+        data = make_feed(num_entries)
+        assert (list(tvfetch.read_feed(data)) ==
+                tvfetch.feedparser_entries(data))
+        since = EPOCH + num_entries // 2 * 3600
+        server = FeedServer(data)
+        url = server.url + '/feed'
+
+        def download(parse):
+            body = http.get(url)[2]
+            parse(body)
+            return len(body)
+
+        def stream(since=None):
+            with http.stream(url) as (status, headers, body):
+                body = CountingReader(body)
+                list(tvfetch.read_feed(body, since, newest_first=True))
+            return body.count
+
+        print('%d entries, %d KB' % (num_entries, len(data) // 1024))
+        print('%-32s %12s %10s %14s' % ('', 'ms/feed', 'KB read',
+                                        'peak alloc KB'))
+        for label, func in (
+                ('download + feedparser',
+                 lambda: download(tvfetch.feedparser_entries)),
+                ('download + read_feed',
+                 lambda: download(lambda body: list(
+                     tvfetch.read_feed(body)))),
+                ('stream + read_feed', stream),
+                ('stream + read_feed (watermark)', lambda: stream(since))):
+            seconds = timeit.timeit(func, number=options.number)
+            print('%-32s %12.3f %10d %14.1f' % (
+                label, seconds / options.number * 1000, func() // 1024,
+                peak_memory(func) / 1024.0))
+        print('')
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""
+Local stand-ins for the services tvfetch talks to, for benchmarking:
+
+- FeedServer serves ezrss-style season feeds at /search/ and the .torrent
+  files they link to at /torrents/.
+- TransmissionServer is a fake Transmission RPC endpoint. Torrents finish
+  downloading and then seed up to their ratio as they are polled.
+- StubTVDB replaces pytvdbapi's TVDB client.
+"""
+import base64
+import email.utils
+import hashlib
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import tvfetch  # noqa: E402
+
+# first episode's publish time; each later episode is an hour newer
+EPOCH = 1388534400
+
+
+def bencode(value):
+    if isinstance(value, int):
+        return b'i%de' % value
+    elif isinstance(value, str):
+        return bencode(value.encode())
+    elif isinstance(value, bytes):
+        return b'%d:%s' % (len(value), value)
+    elif isinstance(value, list):
+        return b'l' + b''.join(bencode(v) for v in value) + b'e'
+    elif isinstance(value, dict):
+        return b'd' + b''.join(bencode(k) + bencode(v)
+                               for k, v in sorted(value.items())) + b'e'
+    raise TypeError(value)
+
+
+def show_name(i):
+    return 'Show %05d' % i
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+
+class _FeedHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == '/search/':
+            self._feed(parse_qs(parts.query))
+        elif parts.path.startswith('/torrents/'):
+            self._torrent(parts.path[len('/torrents/'):])
+        else:
+            self._send(404)
+
+    def _feed(self, query):
+        name = query['show_name'][0]
+        season = int(query['season'][0])
+        etag = '"%s"' % hashlib.sha1(
+            ('%s/%d' % (name, season)).encode()).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, headers=[('ETag', etag)])
+            return
+        self._send(200, self.server.feed(name, season).encode(),
+                   [('Content-Type', 'application/rss+xml'), ('ETag', etag)])
+
+    def _torrent(self, path):
+        name, season, episode = unquote(path[:-len('.torrent')]).split('/')
+        data = self.server.torrent(name, int(season), int(episode))
+        self._send(200, data, [('Content-Type', 'application/x-bittorrent')])
+
+
+class FeedServer(_Server):
+    # Every show has `seasons` seasons of `episodes` episodes, each offered
+    # as `variants` torrents (in seed order).
+    def __init__(self, seasons=3, episodes=10, variants=2, piece_count=2000,
+                 address=('127.0.0.1', 0)):
+        _Server.__init__(self, address, _FeedHandler)
+        self.seasons = seasons
+        self.episodes = episodes
+        self.variants = variants
+        self.piece_count = piece_count
+
+    def feed(self, name, season):
+        items = []
+        for episode in range(1, self.episodes + 1):
+            published = email.utils.formatdate(
+                EPOCH + (season * 100 + episode) * 3600, usegmt=True)
+            for variant in range(self.variants):
+                link = '%s/torrents/%s/%d/%d.torrent' % (
+                    self.url, quote(name), season, episode * 10 + variant)
+                items.append(
+                    '<item><title>%(name)s %(season)dx%(episode)02d</title>'
+                    '<link>%(link)s</link><guid>%(link)s</guid>'
+                    '<pubDate>%(published)s</pubDate>'
+                    '<description>Show Name: %(name)s; Episode Title: '
+                    'Episode %(episode)d; Season: %(season)d; Episode: '
+                    '%(episode)d</description></item>' % {
+                        'name': name, 'season': season, 'episode': episode,
+                        'link': link, 'published': published})
+        return ('<?xml version="1.0" encoding="utf-8"?>'
+                '<rss version="2.0"><channel><title>%s</title>%s'
+                '</channel></rss>' % (name, ''.join(items)))
+
+    def torrent(self, name, season, number):
+        episode, variant = divmod(number, 10)
+        filename = '%s.S%02dE%02d.%d.avi' % (
+            name.replace(' ', '.'), season, episode, variant)
+        seed = hashlib.sha1(filename.encode()).digest()
+        return bencode({
+            'announce': 'http://tracker.invalid/announce',
+            'info': {
+                'name': filename,
+                'length': 1048576,
+                'piece length': 262144,
+                'pieces': seed * self.piece_count,
+            },
+        })
+
+
+class _RPCHandler(BaseHTTPRequestHandler):
+    SESSION_ID = 'benchmark-session'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if self.headers.get('X-Transmission-Session-Id') != self.SESSION_ID:
+            self.send_response(409)
+            self.send_header('X-Transmission-Session-Id', self.SESSION_ID)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        length = int(self.headers['Content-Length'])
+        request = json.loads(self.rfile.read(length).decode())
+        arguments = self.server.call(
+            request['method'], request.get('arguments', {}))
+        body = json.dumps({'result': 'success', 'arguments': arguments,
+                           'tag': request.get('tag')}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TransmissionServer(_Server):
+    # A torrent is done after `download_polls` torrent-get calls, and gains
+    # `ratio_step` upload ratio on every poll after that. Added torrents'
+    # files are created (small) in download_dir.
+    def __init__(self, download_dir, download_polls=2, ratio_step=0.5,
+                 address=('127.0.0.1', 0)):
+        _Server.__init__(self, address, _RPCHandler)
+        self.download_dir = download_dir
+        self.download_polls = download_polls
+        self.ratio_step = ratio_step
+        self.torrents = {}
+        self.hashes = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def call(self, method, arguments):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            handler = getattr(self, '_' + method.replace('-', '_'), None)
+            return handler(arguments) if handler else {}
+
+    def _ids(self, arguments):
+        ids = arguments.get('ids')
+        if ids is None:
+            return list(self.torrents)
+        if not isinstance(ids, list):
+            ids = [ids]
+        return [self.hashes.get(i, i) for i in ids]
+
+    def _session_get(self, arguments):
+        return {'rpc-version': 15, 'rpc-version-minimum': 1,
+                'version': '2.94 (benchmark)'}
+
+    def _torrent_add(self, arguments):
+        data = base64.b64decode(arguments['metainfo'])
+        meta = tvfetch.read_torrent(data)
+        if meta.infohash in self.hashes:
+            return {'torrent-duplicate': {
+                'id': self.hashes[meta.infohash], 'name': meta.name,
+                'hashString': meta.infohash}}
+        torrent_id = self._next_id
+        self._next_id += 1
+        with open(os.path.join(self.download_dir, meta.name), 'wb') as f:
+            f.write(b'\0' * 1024)
+        self.torrents[torrent_id] = {
+            'id': torrent_id, 'name': meta.name, 'hashString': meta.infohash,
+            'polls': 0, 'ratio': 0.0, 'stopped': False,
+        }
+        self.hashes[meta.infohash] = torrent_id
+        return {'torrent-added': {'id': torrent_id, 'name': meta.name,
+                                  'hashString': meta.infohash}}
+
+    def _torrent_get(self, arguments):
+        result = []
+        for torrent_id in self._ids(arguments):
+            t = self.torrents.get(torrent_id)
+            if t is None:
+                continue
+            t['polls'] += 1
+            done = t['polls'] > self.download_polls
+            if done and not t['stopped']:
+                t['ratio'] += self.ratio_step
+            fields = {
+                'id': t['id'], 'name': t['name'],
+                'hashString': t['hashString'],
+                'status': 0 if t['stopped'] else 6 if done else 4,
+                'sizeWhenDone': 1024, 'leftUntilDone': 0 if done else 512,
+                'uploadRatio': t['ratio'], 'downloadDir': self.download_dir,
+                'files': [{'name': t['name'], 'length': 1024,
+                           'bytesCompleted': 1024 if done else 512}],
+                'priorities': [0], 'wanted': [1],
+            }
+            result.append(dict((k, fields[k]) for k in fields
+                               if k in arguments.get('fields', fields)))
+        return {'torrents': result}
+
+    def _torrent_start(self, arguments):
+        for torrent_id in self._ids(arguments):
+            if torrent_id in self.torrents:
+                self.torrents[torrent_id]['stopped'] = False
+        return {}
+
+    def _torrent_stop(self, arguments):
+        for torrent_id in self._ids(arguments):
+            if torrent_id in self.torrents:
+                self.torrents[torrent_id]['stopped'] = True
+        return {}
+
+    def _torrent_remove(self, arguments):
+        for torrent_id in self._ids(arguments):
+            t = self.torrents.pop(torrent_id, None)
+            if t is not None:
+                del self.hashes[t['hashString']]
+                if arguments.get('delete-local-data'):
+                    path = os.path.join(self.download_dir, t['name'])
+                    if os.path.exists(path):
+                        os.remove(path)
+        return {}
+
+
+class StubTVDB(object):
+    # Drop-in for pytvdbapi.api.TVDB. Every show has `seasons` seasons (and
+    # a season 0) of `episodes` episodes.
+    seasons = 3
+    episodes = 10
+
+    class _Episode(object):
+        def __init__(self, number):
+            self.EpisodeNumber = number
+            self.EpisodeName = 'Episode %d' % number
+
+    class _Season(list):
+        def __init__(self, number, episodes):
+            list.__init__(self, [StubTVDB._Episode(e)
+                                 for e in range(1, episodes + 1)])
+            self.season_number = number
+
+    class _Show(list):
+        def __init__(self, name, seasons, episodes):
+            list.__init__(self, [StubTVDB._Season(s, episodes if s else 0)
+                                 for s in range(seasons + 1)])
+            self.SeriesName = name
+            self.id = int(hashlib.sha1(name.encode()).hexdigest()[:7], 16)
+
+    class _Search(list):
+        def __init__(self, name, shows):
+            list.__init__(self, shows)
+            self.search = name
+
+    def __init__(self, api_key, **kwargs):
+        self.calls = 0
+
+    def search(self, name, language):
+        self.calls += 1
+        return self._Search(
+            name, [self._Show(name, self.seasons, self.episodes)])
@@ -7,7 +7,6 @@ setup(
     install_requires=[
         'transmissionrpc',
         'feedparser',
-        'bencodepy',
         'pytvdbapi'
     ],
     entry_points={
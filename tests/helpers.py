@@ -0,0 +1,117 @@
+# Fixtures shared by the tests. Importing this module first makes tvfetch
+# importable from the source tree.
+import collections
+import concurrent.futures
+import functools
+import heapq
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import tvfetch  # noqa: E402
+
+
+class TempDirTestCase(unittest.TestCase):
+    # each test gets an empty directory, self.dir
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+
+class FetcherTestCase(TempDirTestCase):
+    # Each test gets a TvFetch, self.fetcher, with its own database. CONFIG
+    # is added to its config file, after the [daemon] section.
+    CONFIG = ''
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.config = os.path.join(self.dir, 'tvfetch.conf')
+        with open(self.config, 'w') as f:
+            f.write('[daemon]\ndb_path = %s/db.sqlite\nlog_level = error\n'
+                    '\n%s' % (self.dir, self.CONFIG))
+        self.fetcher = tvfetch.TvFetch(self.config)
+        self.db = self.fetcher.db
+        self.addCleanup(self.db.close)
+
+
+DoneAndNotDone = collections.namedtuple('DoneAndNotDone', 'done not_done')
+
+
+class FakeClock(object):
+    # Stands in for the time module (patched over tvfetch.time) in tests of
+    # timing code. Time only passes in advance() and wait(), which run the
+    # callbacks scheduled with at() as their time comes.
+    def __init__(self, now=1000.0):
+        self.now = now
+        self._events = []  # heap of (time, sequence, callback)
+        self._sequence = itertools.count()
+
+    def time(self):
+        return self.now
+
+    monotonic = time
+
+    def at(self, when, callback):
+        heapq.heappush(self._events, (when, next(self._sequence), callback))
+
+    def _run(self, end, stop):
+        # runs the callbacks due by end, unless stop() becomes true first;
+        # those due at the same time run together
+        while self._events and self._events[0][0] <= end and (
+                not stop() or self._events[0][0] <= self.now):
+            when, sequence, callback = heapq.heappop(self._events)
+            self.now = max(self.now, when)
+            callback()
+        if not stop():
+            if end == float('inf'):
+                raise AssertionError('waiting forever')
+            self.now = max(self.now, end)
+
+    def advance(self, seconds):
+        self._run(self.now + seconds, lambda: False)
+
+    def wait(self, futures, timeout=None,
+             return_when=concurrent.futures.ALL_COMPLETED):
+        # concurrent.futures.wait, in fake time
+        futures = set(futures)
+        check = all
+        if return_when == concurrent.futures.FIRST_COMPLETED:
+            check = any
+        end = float('inf') if timeout is None else self.now + timeout
+        self._run(end, lambda: check(f.done() for f in futures))
+        done = set(f for f in futures if f.done())
+        return DoneAndNotDone(done, futures - done)
+
+
+class FakeExecutor(object):
+    # Runs the calls submitted to it on a FakeClock. Each call starts after
+    # delay seconds, and its result (or exception) arrives after the next
+    # of durations; a duration of None means it never finishes.
+    def __init__(self, clock, durations, delay=0):
+        self.clock = clock
+        self.durations = list(durations)
+        self.delay = delay
+        self.submitted = 0
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        duration = self.durations.pop(0)
+        self.submitted += 1
+
+        def start():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                finish = functools.partial(future.set_exception, e)
+            else:
+                finish = functools.partial(future.set_result, result)
+            if duration is not None:
+                self.clock.at(self.clock.now + duration, finish)
+        self.clock.at(self.clock.now + self.delay, start)
+        return future
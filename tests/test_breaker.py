@@ -0,0 +1,76 @@
+import unittest
+from unittest import mock
+
+from helpers import FakeClock, tvfetch
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(tvfetch, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = tvfetch.CircuitBreaker(
+            'Transmission', max_failures=3, retry_interval=30,
+            max_interval=100)
+
+    def fail(self, times=1):
+        with self.assertLogs(tvfetch.log, 'WARNING'):
+            for i in range(times):
+                self.breaker.failure()
+
+    def test_opens_after_max_failures(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.assertTrue(self.breaker.allow())
+        self.fail()
+        self.assertFalse(self.breaker.allow())
+        self.clock.advance(29)
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_the_count(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        self.breaker.success()
+        self.breaker.failure()
+        self.breaker.failure()
+        self.assertTrue(self.breaker.allow())
+
+    def test_half_open(self):
+        self.fail(3)
+        self.clock.advance(30)
+        # one trial call is let through
+        self.assertTrue(self.breaker.allow())
+        with self.assertLogs(tvfetch.log, 'INFO'):
+            self.breaker.success()
+        self.assertTrue(self.breaker.allow())
+        # and it takes max_failures failures to open again
+        self.breaker.failure()
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_backs_off(self):
+        self.fail(3)
+        for interval in (60, 100, 100):
+            self.clock.advance(self.breaker.interval)
+            self.assertTrue(self.breaker.allow())
+            self.fail()
+            self.assertEqual(self.breaker.interval, interval)
+            self.clock.advance(interval - 1)
+            self.assertFalse(self.breaker.allow())
+            self.clock.advance(1)
+            self.assertTrue(self.breaker.allow())
+
+    def test_success_resets_the_interval(self):
+        self.fail(3)
+        self.clock.advance(30)
+        self.fail()
+        self.clock.advance(60)
+        self.breaker.success()
+        self.fail(3)
+        self.assertEqual(self.breaker.interval, 30)
+        self.clock.advance(30)
+        self.assertTrue(self.breaker.allow())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import os
+import unittest
+
+from helpers import TempDirTestCase, tvfetch
+
+
+class SourcesTest(TempDirTestCase):
+    def sources(self, url):
+        path = os.path.join(self.dir, 'tvfetch.conf')
+        with open(path, 'w') as f:
+            f.write('[source:test]\nurl = %s\n' % url)
+        return tvfetch.Config(path).sources()
+
+    def test_url(self):
+        url = 'http://t.invalid/?q=%(show_name)s+%(quality)s&s=%(season)02d'
+        self.assertEqual(self.sources(url)['test'].url, url)
+        self.assertIn('ezrss', self.sources(url))
+        self.sources('http://t.invalid/rss?q=%(show_name)s%%20S%(season)d')
+
+    def test_bad_url(self):
+        for url in ('http://t.invalid/?q=%(name)s',
+                    'http://t.invalid/?q=%(show_name)s%20',
+                    'http://t.invalid/?s=%(season)d%',
+                    'http://t.invalid/?s=%(season)x%(show_name)d'):
+            with self.assertRaises(tvfetch.UserError):
+                self.sources(url)
+
+
+if __name__ == '__main__':
+    unittest.main()
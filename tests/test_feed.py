@@ -0,0 +1,140 @@
+import email.utils
+import gzip
+import io
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from helpers import tvfetch
+
+EPOCH = 1388534400  # 2014-01-01
+
+
+def rss(published, padding=0):
+    # an item for each publish time, padded out to make the feed bigger
+    items = ''.join(
+        '<item><title>Show S01E%02d</title><link>http://t.invalid/%d</link>'
+        '<guid>%d</guid><pubDate>%s</pubDate><description>%s</description>'
+        '</item>' % (i, i, i, email.utils.formatdate(p, usegmt=True),
+                     'x' * padding)
+        for i, p in enumerate(published))
+    return ('<?xml version="1.0" encoding="utf-8"?><rss version="2.0">'
+            '<channel><title>Show</title>%s</channel></rss>' % items).encode()
+
+
+class CountingReader(object):
+    def __init__(self, data):
+        self.f = io.BytesIO(data)
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.count += len(data)
+        return data
+
+
+class ReadFeedTest(unittest.TestCase):
+    def test_rss(self):
+        entries = list(tvfetch.read_feed(rss([EPOCH, EPOCH + 60])))
+        self.assertEqual([e['id'] for e in entries], ['0', '1'])
+        self.assertEqual(entries[0]['title'], 'Show S01E00')
+        self.assertEqual(entries[0]['link'], 'http://t.invalid/0')
+        self.assertEqual(entries[1]['published'], EPOCH + 60)
+
+    def test_atom(self):
+        data = (b'<feed xmlns="http://www.w3.org/2005/Atom"><entry>'
+                b'<title>Show 1x02</title><id>tag:a</id>'
+                b'<link href="http://t.invalid/a"/>'
+                b'<published>2014-01-01T00:00:00Z</published></entry></feed>')
+        entries = list(tvfetch.read_feed(data))
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['id'], 'tag:a')
+        self.assertEqual(entries[0]['link'], 'http://t.invalid/a')
+        self.assertEqual(entries[0]['published'], EPOCH)
+
+    def test_since(self):
+        data = rss([EPOCH, EPOCH + 120, EPOCH + 60])
+        self.assertEqual([e['id'] for e in tvfetch.read_feed(
+            data, EPOCH + 60)], ['1', '2'])
+
+    def test_newest_first_stops_at_the_first_older_entry(self):
+        published = [EPOCH + 3600 * i for i in range(1000, 0, -1)]
+        data = rss(published, padding=100)
+        feed = CountingReader(data)
+        entries = list(tvfetch.read_feed(feed, published[9],
+                                         newest_first=True))
+        self.assertEqual(len(entries), 10)
+        # the rest of the feed is never read
+        self.assertLess(feed.count, len(data) // 10)
+
+    def test_not_xml(self):
+        with self.assertRaises(tvfetch.ElementTree.ParseError):
+            list(tvfetch.read_feed(b'<rss><channel><item>'))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            BaseHTTPRequestHandler.handle(self)
+        except OSError:
+            pass
+
+    def do_GET(self):
+        self.server.requests += 1
+        data = self.server.data
+        self.send_response(200)
+        if self.path == '/gzip':
+            data = gzip.compress(data)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        for start in range(0, len(data), 16384):
+            self.wfile.write(data[start:start + 16384])
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.requests = 0
+        self.published = [EPOCH + 3600 * i for i in range(2000, 0, -1)]
+        self.server.data = rss(self.published, padding=100)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.http = tvfetch.HTTPPool()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def pooled(self):
+        return sum(len(c) for c in self.http._idle.values())
+
+    def read(self, path, since=None):
+        with self.http.stream(self.url + path) as (status, headers, body):
+            self.assertEqual(status, 200)
+            return list(tvfetch.read_feed(body, since, newest_first=True))
+
+    def test_whole_feed_reuses_the_connection(self):
+        for path in ('/plain', '/gzip'):
+            self.assertEqual(len(self.read(path)), len(self.published))
+        self.assertEqual(self.pooled(), 1)
+
+    def test_early_stop_closes_the_connection(self):
+        for path in ('/plain', '/gzip'):
+            entries = self.read(path, self.published[4])
+            self.assertEqual(len(entries), 5)
+            self.assertEqual(self.pooled(), 0)
+        # and the next request gets a new one
+        self.assertEqual(len(self.read('/plain')), len(self.published))
+        self.assertEqual(self.server.requests, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+from helpers import tvfetch
+
+HASH = '0123456789abcdef0123456789abcdef01234567'
+
+
+def parse_title(title):
+    return tvfetch.FEED_FORMATS['title'].parse_episode({'title': title})
+
+
+class TitleFormatTest(unittest.TestCase):
+    def test_release_names(self):
+        self.assertEqual(parse_title('Dexter S05E01 720p HDTV'),
+                         ('Dexter', 5, 1, None))
+        self.assertEqual(parse_title('Dexter.5x01.HDTV'),
+                         ('Dexter', 5, 1, None))
+        self.assertEqual(parse_title('The_Wire.s02e11.DSR'),
+                         ('The Wire', 2, 11, None))
+        self.assertEqual(parse_title('Show S01 E03'), ('Show', 1, 3, None))
+
+    def test_multi_episode_release(self):
+        self.assertEqual(parse_title('Show S05E01E02 HDTV'),
+                         ('Show', 5, 1, None))
+        self.assertEqual(parse_title('Show S05E01-E02 HDTV'),
+                         ('Show', 5, 1, None))
+
+    def test_no_show_name(self):
+        self.assertEqual(parse_title('S01E02'), (None, 1, 2, None))
+
+    def test_no_episode(self):
+        self.assertIsNone(parse_title('Show Season 5 Complete'))
+        self.assertIsNone(parse_title('Show 1080p'))
+        self.assertIsNone(tvfetch.FEED_FORMATS['title'].parse_episode({}))
+
+
+class EzrssFormatTest(unittest.TestCase):
+    def test_summary(self):
+        entry = {'summary': 'Show Name: Some Show; Episode Title: Pilot; '
+                            'Season: 1; Episode: 1'}
+        self.assertEqual(tvfetch.FEED_FORMATS['ezrss'].parse_episode(entry),
+                         ('Some Show', 1, 1, 'Pilot'))
+
+    def test_missing_fields(self):
+        entry = {'summary': 'Show Name: Some Show; Season: 2; Episode: 3'}
+        self.assertEqual(tvfetch.FEED_FORMATS['ezrss'].parse_episode(entry),
+                         ('Some Show', 2, 3, None))
+        for summary in ('Show Name: Some Show; Season: 2',
+                        'Season: two; Episode: 3', ''):
+            self.assertIsNone(tvfetch.FEED_FORMATS['ezrss'].parse_episode(
+                {'summary': summary}))
+
+
+class ParseTest(unittest.TestCase):
+    def test_record(self):
+        entry = {'id': 'guid-1', 'title': 'Show S01E02',
+                 'link': 'magnet:?xt=urn:btih:%s' % HASH.upper(),
+                 'published': 100.0}
+        record = tvfetch.FEED_FORMATS['title'].parse(entry, 3)
+        self.assertEqual((record.show, record.season, record.episode),
+                         ('Show', 1, 2))
+        self.assertEqual(record.rank, 3)
+        self.assertEqual(record.guid, 'guid-1')
+        self.assertEqual(record.infohash, HASH)
+        self.assertEqual(record.published, 100.0)
+
+    def test_unreadable_entry(self):
+        entry = {'title': 'Not an episode', 'link': 'http://t.invalid/1'}
+        record = tvfetch.FEED_FORMATS['title'].parse(entry, 0)
+        self.assertIsNone(record.season)
+        self.assertIsNone(record.infohash)
+        # entries without an id are known by their link
+        self.assertEqual(record.guid, 'http://t.invalid/1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+from unittest import mock
+
+from helpers import FakeClock, FakeExecutor, tvfetch
+
+
+def source(name, timeout=30):
+    return tvfetch.FeedSource(name, None, None, timeout, False)
+
+
+class HedgedRequestTest(unittest.TestCase):
+    HEDGE_DELAY = 5
+
+    def setUp(self):
+        self.clock = FakeClock()
+        for patcher in (mock.patch.object(tvfetch, 'time', self.clock),
+                        mock.patch('concurrent.futures.wait',
+                                   self.clock.wait)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.started = {}  # source name: start time
+
+    def fetch(self, source):
+        self.started[source.name] = self.clock.now
+        result = self.answers[source.name]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def request(self, sources, durations, answers, delays={}):
+        # durations: {source name: seconds to answer, or None for never}
+        self.answers = answers
+        self.executors = dict(
+            (s.name, FakeExecutor(self.clock, [durations[s.name]],
+                                  delays.get(s.name, 0)))
+            for s in sources)
+        start = self.clock.now
+        results = tvfetch.HedgedRequest(
+            self.executors, self.fetch, sources, self.HEDGE_DELAY).results()
+        return [(s.name, result) for s, result in results], (
+            self.clock.now - start)
+
+    def test_first_source_answers(self):
+        results, elapsed = self.request(
+            [source('a'), source('b')], {'a': 1, 'b': 1}, {'a': 'A'})
+        self.assertEqual(results, [('a', 'A')])
+        self.assertAlmostEqual(elapsed, 1)
+        self.assertEqual(self.executors['b'].submitted, 0)
+
+    def test_hedge_after_hedge_delay(self):
+        results, elapsed = self.request(
+            [source('a'), source('b')], {'a': 10, 'b': 1},
+            {'a': 'A', 'b': 'B'})
+        self.assertAlmostEqual(self.started['b'] - self.started['a'],
+                               self.HEDGE_DELAY)
+        self.assertEqual(results, [('b', 'B')])
+        self.assertAlmostEqual(elapsed, self.HEDGE_DELAY + 1)
+
+    def test_every_answer_by_then_is_returned(self):
+        # a answers just after b was asked, before b answers
+        results, elapsed = self.request(
+            [source('a'), source('b'), source('c')],
+            {'a': 5.5, 'b': 0.5, 'c': 1}, {'a': 'A', 'b': 'B', 'c': 'C'})
+        self.assertEqual(results, [('a', 'A'), ('b', 'B')])
+        self.assertNotIn('c', self.started)
+        self.assertAlmostEqual(elapsed, 5.5)
+
+    def test_failure_hedges_right_away(self):
+        results, elapsed = self.request(
+            [source('a'), source('b')], {'a': 1, 'b': 1},
+            {'a': None, 'b': 'B'})
+        self.assertAlmostEqual(self.started['b'] - self.started['a'], 1)
+        self.assertEqual(results, [('b', 'B')])
+
+    def test_source_timeout(self):
+        results, elapsed = self.request([source('a', timeout=3)],
+                                        {'a': None}, {'a': 'A'})
+        self.assertEqual(results, [])
+        self.assertAlmostEqual(elapsed, 3)
+
+    def test_each_source_has_its_own_timeout(self):
+        results, elapsed = self.request(
+            [source('a', timeout=8), source('b', timeout=20)],
+            {'a': None, 'b': 12}, {'a': 'A', 'b': 'B'})
+        # a timed out at 8, b answered at 5 + 12
+        self.assertEqual(results, [('b', 'B')])
+        self.assertAlmostEqual(elapsed, self.HEDGE_DELAY + 12)
+
+        results, elapsed = self.request(
+            [source('a', timeout=8), source('b', timeout=6)],
+            {'a': None, 'b': None}, {'a': 'A', 'b': 'B'})
+        self.assertEqual(results, [])
+        self.assertAlmostEqual(elapsed, self.HEDGE_DELAY + 6)
+
+    def test_timeout_and_hedge_count_from_the_start(self):
+        # a waits 4 seconds for a free worker before it is asked
+        results, elapsed = self.request(
+            [source('a', timeout=10), source('b')], {'a': None, 'b': 1},
+            {'a': 'A', 'b': 'B'}, delays={'a': 4})
+        self.assertAlmostEqual(self.started['b'] - self.started['a'],
+                               self.HEDGE_DELAY)
+        self.assertEqual(results, [('b', 'B')])
+
+    def test_errors_are_logged(self):
+        with self.assertLogs(tvfetch.log, 'ERROR') as logs:
+            results, elapsed = self.request(
+                [source('a'), source('b')], {'a': 1, 'b': 1},
+                {'a': EOFError('truncated'), 'b': 'B'})
+        self.assertEqual(results, [('b', 'B')])
+        self.assertIn('truncated', logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
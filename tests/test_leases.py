@@ -0,0 +1,146 @@
+import unittest
+from unittest import mock
+
+from helpers import FakeClock, FetcherTestCase, tvfetch
+
+SHOWS = ['a', 'b', 'c', 'd']
+
+
+class LeasesTest(FetcherTestCase):
+    # workers sharing the database, on a fake clock
+    TTL = 60
+
+    def setUp(self):
+        FetcherTestCase.setUp(self)
+        self.clock = FakeClock()
+        patcher = mock.patch.object(tvfetch, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def worker(self, number):
+        return tvfetch.Leases(self.db, 'host:%d' % number, self.TTL)
+
+    def held(self, leases):
+        return sorted(cfg_name for cfg_name in SHOWS
+                      if leases.holds(cfg_name))
+
+    def test_single_worker_takes_every_show(self):
+        a = self.worker(1)
+        self.assertEqual(a.heartbeat(SHOWS), (set(SHOWS), set()))
+        self.assertEqual(self.held(a), SHOWS)
+        self.assertEqual(a.heartbeat(SHOWS), (set(), set()))
+
+    def test_rebalanced_when_a_worker_joins(self):
+        a, b = self.worker(1), self.worker(2)
+        a.heartbeat(SHOWS)
+        # b only gets shows once a has given up its extra ones
+        self.assertEqual(b.heartbeat(SHOWS), (set(), set()))
+        gained, lost = a.heartbeat(SHOWS)
+        self.assertEqual(len(lost), 2)
+        self.assertEqual(b.heartbeat(SHOWS), (lost, set()))
+        self.assertEqual(sorted(self.held(a) + self.held(b)), SHOWS)
+        self.assertEqual(len(self.held(a)), 2)
+
+    def test_kept_shows_are_not_given_up(self):
+        a, b = self.worker(1), self.worker(2)
+        a.heartbeat(SHOWS)
+        b.heartbeat(SHOWS)
+        self.assertEqual(a.heartbeat(SHOWS, keep=SHOWS), (set(), set()))
+        self.assertEqual(self.held(a), SHOWS)
+
+    def test_removed_shows_are_given_up(self):
+        a = self.worker(1)
+        a.heartbeat(SHOWS)
+        self.assertEqual(a.heartbeat(['a'], keep=SHOWS),
+                         (set(), {'b', 'c', 'd'}))
+
+    def test_taken_over_when_a_worker_dies(self):
+        a, b = self.worker(1), self.worker(2)
+        a.heartbeat(SHOWS)
+        b.heartbeat(SHOWS)
+        self.clock.advance(self.TTL / 3)
+        b.heartbeat(SHOWS)
+        # a stops renewing its leases
+        self.clock.advance(self.TTL / 3 * 2)
+        self.assertEqual(self.held(a), [])
+        # a's leases are free, but it still counts as a worker until its
+        # own expiry has passed, so b only takes its fair share of them
+        gained, lost = b.heartbeat(SHOWS)
+        self.assertEqual(len(gained), 2)
+        self.clock.advance(1)
+        self.assertEqual(b.heartbeat(SHOWS)[0], set(SHOWS) - gained)
+        self.assertEqual(self.held(b), SHOWS)
+
+        # a comes back, and finds its shows gone
+        self.assertEqual(a.heartbeat(SHOWS), (set(), set(SHOWS)))
+
+    def test_renew(self):
+        a = self.worker(1)
+        a.heartbeat(SHOWS)
+        self.assertFalse(a.due())
+        self.clock.advance(self.TTL / 3)
+        self.assertTrue(a.due())
+        self.assertEqual(a.renew(), set())
+        self.assertFalse(a.due())
+        self.clock.advance(self.TTL - 1)
+        self.assertEqual(self.held(a), SHOWS)
+
+    def test_renew_gives_up_shows_taken_over(self):
+        a, b = self.worker(1), self.worker(2)
+        a.heartbeat(SHOWS)
+        # a is busy for longer than its leases last
+        self.clock.advance(self.TTL + 1)
+        b.heartbeat(SHOWS)
+        self.assertEqual(a.renew(), set(SHOWS))
+        self.assertEqual(self.held(a), [])
+
+    def test_release(self):
+        a, b = self.worker(1), self.worker(2)
+        a.heartbeat(SHOWS)
+        a.release()
+        self.assertEqual(self.held(a), [])
+        self.assertEqual(b.heartbeat(SHOWS), (set(SHOWS), set()))
+
+
+class WorkerLeasesTest(FetcherTestCase):
+    # the shows a worker process of the daemon leases
+    CONFIG = '[Show]\n'
+
+    def setUp(self):
+        FetcherTestCase.setUp(self)
+        self.fetcher.leases = tvfetch.Leases(self.db, 'host:1', 60)
+
+    def test_removed_shows_with_torrents_are_leased(self):
+        # shows that are no longer in the config
+        db = self.db
+        with db:
+            for cfg_name, status in (
+                    ('Downloading', tvfetch.STATUS_INCOMPLETE),
+                    ('Seeding', tvfetch.STATUS_SEEDING),
+                    ('Removing', tvfetch.STATUS_REMOVING),
+                    ('Done', tvfetch.STATUS_COMPLETE)):
+                db.execute('insert into shows (name, season, episode, status, '
+                           'transid, cfg_name) values (?, 1, 1, ?, 1, ?)',
+                           (cfg_name, status, cfg_name))
+            db.execute("insert into outbox (cfg_name, name, season, episode, "
+                       "url) values ('Waiting', 'Waiting', 1, 1, 'x')")
+        self.assertTrue(self.fetcher._renew_leases())
+        held = set(cfg_name for cfg_name in ('Show', 'Downloading', 'Seeding',
+                                             'Removing', 'Waiting', 'Done')
+                   if self.fetcher._holds(cfg_name))
+        self.assertEqual(held, {'Show', 'Downloading', 'Seeding', 'Removing',
+                                'Waiting'})
+        # but they aren't checked for new episodes
+        self.assertEqual(list(self.fetcher._check_intervals()), ['Show'])
+
+        # and are given up once they have nothing left
+        with db:
+            db.execute('delete from shows')
+            db.execute('delete from outbox')
+        self.fetcher._renew_leases()
+        self.assertFalse(self.fetcher._holds('Downloading'))
+        self.assertTrue(self.fetcher._holds('Show'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+
+from helpers import FetcherTestCase, tvfetch
+
+
+class ResetShowTest(FetcherTestCase):
+    # --reset-show run while the daemon (self.daemon) is running
+    CONFIG = '[Show]\n\n[Other]\n'
+
+    def setUp(self):
+        FetcherTestCase.setUp(self)
+        self.daemon = self.fetcher
+        self.add('Show', 1, 1)
+        self.add('Other', 1, 1)
+        self.daemon.find_new([])
+
+    def add(self, cfg_name, season, episode):
+        infohash = '%s-%d-%d' % (cfg_name, season, episode)
+        with self.daemon.db:
+            self.daemon.db.execute(
+                'insert into shows (name, season, episode, status, cfg_name, '
+                'infohash) values (?, ?, ?, ?, ?, ?)',
+                (cfg_name, season, episode, tvfetch.STATUS_COMPLETE,
+                 cfg_name, infohash))
+
+    def reset(self, cfg_name):
+        fetcher = tvfetch.TvFetch(self.config)
+        fetcher.reset_show(cfg_name)
+        fetcher.db.close()
+
+    def test_reset_show_is_picked_up_on_the_next_check(self):
+        episodes = self.daemon.episodes
+        self.assertTrue(episodes.contains('Show', 1, 1))
+        self.assertTrue(episodes.has_infohash('Show-1-1'))
+        self.reset('Show')
+        # cached until the next check
+        self.assertTrue(episodes.contains('Show', 1, 1))
+        self.daemon.find_new([])
+        self.assertFalse(episodes.contains('Show', 1, 1))
+        self.assertFalse(episodes.has_infohash('Show-1-1'))
+        self.assertTrue(episodes.contains('Other', 1, 1))
+
+    def test_seen_entries_are_dropped_too(self):
+        url = 'http://t.invalid/show/1'
+        entries = [{'id': 'a', 'link': 'http://t.invalid/a',
+                    'title': 'Show S01E01', 'published': 100}]
+        seen = self.daemon.seen
+        seen.update('Show', [(url, [tvfetch.FEED_FORMATS['title'].parse(
+            entries[0], 0)])], {'a'})
+        self.daemon.writes.flush()
+        self.assertEqual(seen.unseen('Show', url, entries), [])
+        self.reset('Show')
+        self.daemon.find_new([])
+        self.assertIsNone(seen.watermark('Show', url))
+        self.assertEqual(seen.unseen('Show', url, entries), entries)
+
+    def test_each_reset_is_picked_up(self):
+        self.reset('Show')
+        self.daemon.find_new([])
+        self.add('Show', 1, 1)
+        self.daemon.episodes.add('Show', 1, 1, 'Show-1-1')
+        self.daemon.find_new([])
+        self.assertTrue(self.daemon.episodes.contains('Show', 1, 1))
+        self.reset('Show')
+        self.daemon.find_new([])
+        self.assertFalse(self.daemon.episodes.contains('Show', 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
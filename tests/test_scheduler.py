@@ -0,0 +1,83 @@
+import random
+import unittest
+from unittest import mock
+
+from helpers import FakeClock, tvfetch
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(tvfetch, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = tvfetch.Scheduler(jitter=0, max_backoff=1000)
+
+    def due(self):
+        return sorted(self.scheduler.due(self.clock.now))
+
+    def check(self, ok=True):
+        # checks the shows that are due
+        due = self.due()
+        for cfg_name in due:
+            self.scheduler.done(cfg_name, ok)
+        return due
+
+    def test_new_shows_are_due_right_away(self):
+        self.scheduler.sync({'a': 100, 'b': 200})
+        self.assertEqual(self.check(), ['a', 'b'])
+        self.assertEqual(self.scheduler.next_deadline(), self.clock.now + 100)
+        self.clock.advance(99)
+        self.assertEqual(self.check(), [])
+        self.clock.advance(1)
+        self.assertEqual(self.check(), ['a'])
+        self.clock.advance(100)
+        self.assertEqual(self.check(), ['a', 'b'])
+
+    def test_backoff(self):
+        self.scheduler.sync({'a': 100})
+        self.check()
+        for delay in (200, 400, 800, 1000, 1000):
+            self.clock.advance(self.scheduler.next_deadline() -
+                               self.clock.now)
+            self.assertEqual(self.check(ok=False), ['a'])
+            self.assertEqual(self.scheduler.next_deadline(),
+                             self.clock.now + delay)
+        # a successful check goes back to the show's interval
+        self.clock.advance(1000)
+        self.check()
+        self.assertEqual(self.scheduler.next_deadline(), self.clock.now + 100)
+
+    def test_backoff_never_shortens_the_interval(self):
+        self.scheduler.sync({'a': 2000})
+        self.check(ok=False)
+        self.assertEqual(self.scheduler.next_deadline(), self.clock.now + 2000)
+
+    def test_sync(self):
+        self.scheduler.sync({'a': 100, 'b': 100})
+        self.check()
+        # removed shows are dropped, and new intervals apply after the next
+        # check
+        self.scheduler.sync({'a': 50})
+        self.clock.advance(100)
+        self.assertEqual(self.check(), ['a'])
+        self.assertEqual(self.scheduler.next_deadline(), self.clock.now + 50)
+        self.scheduler.done('b', True)
+        self.assertEqual(self.scheduler.next_deadline(), self.clock.now + 50)
+
+    def test_jitter(self):
+        random.seed(1)
+        scheduler = tvfetch.Scheduler(jitter=0.1)
+        scheduler.sync(dict(('show %d' % i, 100) for i in range(100)))
+        # new shows are spread over the jitter
+        early = len(scheduler.due(self.clock.now + 5))
+        self.assertTrue(0 < early < 100)
+        self.assertEqual(len(scheduler.due(self.clock.now + 10)), 100 - early)
+        for i in range(100):
+            scheduler.done('show %d' % i, True)
+        self.assertEqual(scheduler.due(self.clock.now + 90), [])
+        self.assertEqual(len(scheduler.due(self.clock.now + 110)), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+
+from helpers import FetcherTestCase, tvfetch
+
+FEED_A = 'http://a.invalid/show/1'
+FEED_B = 'http://b.invalid/show/1'
+
+
+def entry(guid, published):
+    return {'id': guid, 'link': 'http://torrents.invalid/%s' % guid,
+            'title': 'Show S01E01', 'published': published}
+
+
+def records(entries):
+    return [tvfetch.FEED_FORMATS['title'].parse(e, i)
+            for i, e in enumerate(entries)]
+
+
+class SeenEntriesTest(FetcherTestCase):
+    def setUp(self):
+        FetcherTestCase.setUp(self)
+        self.seen = self.fetcher.seen
+
+    def check(self, url, entries, evaluated):
+        # one check of a feed: returns the entries that were looked at
+        unseen = self.seen.unseen('Show', url, entries)
+        self.seen.update('Show', [(url, records(unseen))],
+                         set(evaluated))
+        self.fetcher.writes.flush()
+        return [e['id'] for e in unseen]
+
+    def test_evaluated_entries_are_skipped(self):
+        entries = [entry('a', 100), entry('b', 200), entry('c', 300)]
+        self.assertEqual(self.check(FEED_A, entries, ['a', 'b', 'c']),
+                         ['a', 'b', 'c'])
+        self.assertEqual(self.seen.watermark('Show', FEED_A), 300)
+        self.assertEqual(self.check(FEED_A, entries, ['a', 'b', 'c']), [])
+
+    def test_pending_entries_hold_back_the_watermark(self):
+        entries = [entry('a', 100), entry('b', 200), entry('c', 300)]
+        self.check(FEED_A, entries, ['a', 'c'])
+        self.assertEqual(self.seen.watermark('Show', FEED_A), 200)
+        # c is newer than the watermark, but was evaluated
+        self.assertEqual(self.check(FEED_A, entries, []), ['b'])
+        self.assertEqual(self.check(FEED_A, entries, ['b']), ['b'])
+        self.assertEqual(self.check(FEED_A, entries, []), [])
+
+    def test_watermark_never_moves_down(self):
+        self.check(FEED_A, [entry('a', 300)], ['a'])
+        self.check(FEED_A, [entry('b', 100)], [])
+        self.assertEqual(self.seen.watermark('Show', FEED_A), 300)
+
+    def test_entries_without_publish_time(self):
+        entries = [entry('a', None), entry('b', None)]
+        self.assertEqual(self.check(FEED_A, entries, ['a']), ['a', 'b'])
+        self.assertIsNone(self.seen.watermark('Show', FEED_A))
+        self.assertEqual(self.check(FEED_A, entries, []), ['b'])
+
+    def test_each_feed_has_its_own_watermark(self):
+        # the second source is only asked once the first is slow, and
+        # lists an older entry the first one doesn't have
+        self.check(FEED_A, [entry('a1', 100), entry('a2', 500)],
+                   ['a1', 'a2'])
+        self.assertIsNone(self.seen.watermark('Show', FEED_B))
+        self.assertEqual(
+            self.check(FEED_B, [entry('b1', 200), entry('b2', 500)], []),
+            ['b1', 'b2'])
+        self.assertEqual(self.seen.watermark('Show', FEED_A), 500)
+        self.assertEqual(self.seen.watermark('Show', FEED_B), 200)
+
+    def test_update_takes_several_feeds(self):
+        unseen_a = [entry('a1', 100), entry('a2', 300)]
+        unseen_b = [entry('b1', 200)]
+        self.seen.update('Show', [(FEED_A, records(unseen_a)),
+                                  (FEED_B, records(unseen_b))], {'a1', 'b1'})
+        self.assertEqual(self.seen.watermark('Show', FEED_A), 300)
+        self.assertEqual(self.seen.watermark('Show', FEED_B), 200)
+
+    def test_saved_in_the_database(self):
+        entries = [entry('a', 100), entry('b', 200), entry('c', 300)]
+        self.check(FEED_A, entries, ['a', 'c'])
+        seen = tvfetch.SeenEntries(self.db, self.fetcher.writes)
+        self.assertEqual(seen.watermark('Show', FEED_A), 200)
+        self.assertEqual([e['id'] for e in seen.unseen('Show', FEED_A,
+                                                       entries)], ['b'])
+        # entries below the watermark are no longer stored
+        self.assertEqual(self.db.execute(
+            'select guid, url from seen').fetchall(), [('c', FEED_A)])
+
+    def test_forget(self):
+        entries = [entry('a', 100), entry('b', 200)]
+        self.check(FEED_A, entries, ['a', 'b'])
+        self.seen.forget('Show')
+        self.fetcher.writes.flush()
+        self.assertIsNone(self.seen.watermark('Show', FEED_A))
+        self.seen.invalidate('Show')
+        self.assertIsNone(self.seen.watermark('Show', FEED_A))
+        self.assertEqual(self.check(FEED_A, entries, []), ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
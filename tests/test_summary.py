@@ -0,0 +1,113 @@
+import time
+import unittest
+
+from helpers import FetcherTestCase
+from tvfetch import STATUS_COMPLETE, STATUS_INCOMPLETE, STATUS_SEEDING
+
+
+class ShowSummaryTest(FetcherTestCase):
+    CONFIG = '[Show]\n\n[Other]\n'
+
+    def add(self, season, episode, status, cfg_name='Show', completed=None):
+        with self.db:
+            self.db.execute(
+                'insert into shows (name, season, episode, title, status, '
+                'url, transid, cfg_name, infohash, completed) '
+                'values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (cfg_name, season, episode, 'Episode %d' % episode, status,
+                 'http://t.invalid/%d/%d' % (season, episode),
+                 season * 100 + episode, cfg_name,
+                 '%s-%d-%d' % (cfg_name, season, episode), completed))
+
+    def summary(self, cfg_name='Show'):
+        # (last_season, last_episode, incomplete, seeding, complete)
+        return self.db.execute(
+            'select last_season, last_episode, incomplete, seeding, '
+            'complete from show_summary where cfg_name=?',
+            (cfg_name,)).fetchone()
+
+    def set_status(self, season, episode, status):
+        with self.db:
+            self.db.execute(
+                'update shows set status=? where cfg_name=? and season=? '
+                'and episode=?', (status, 'Show', season, episode))
+
+    def delete(self, season, episode):
+        with self.db:
+            self.db.execute(
+                'delete from shows where cfg_name=? and season=? and '
+                'episode=?', ('Show', season, episode))
+
+    def test_insert(self):
+        self.assertIsNone(self.summary())
+        self.add(1, 2, STATUS_INCOMPLETE)
+        self.assertEqual(self.summary(), (1, 2, 1, 0, 0))
+        # an older episode doesn't move the last one back
+        self.add(1, 1, STATUS_COMPLETE)
+        self.assertEqual(self.summary(), (1, 2, 1, 0, 1))
+        self.add(2, 1, STATUS_SEEDING)
+        self.assertEqual(self.summary(), (2, 1, 1, 1, 1))
+        self.add(1, 5, STATUS_INCOMPLETE, cfg_name='Other')
+        self.assertEqual(self.summary(), (2, 1, 1, 1, 1))
+        self.assertEqual(self.summary('Other'), (1, 5, 1, 0, 0))
+
+    def test_status_update(self):
+        self.add(1, 1, STATUS_INCOMPLETE)
+        self.set_status(1, 1, STATUS_SEEDING)
+        self.assertEqual(self.summary(), (1, 1, 0, 1, 0))
+        self.set_status(1, 1, STATUS_COMPLETE)
+        self.assertEqual(self.summary(), (1, 1, 0, 0, 1))
+        # an update that doesn't change the status changes nothing
+        self.set_status(1, 1, STATUS_COMPLETE)
+        self.assertEqual(self.summary(), (1, 1, 0, 0, 1))
+
+    def test_delete(self):
+        self.add(1, 1, STATUS_COMPLETE)
+        self.add(1, 2, STATUS_SEEDING)
+        self.add(2, 1, STATUS_INCOMPLETE)
+        # an episode that isn't the last one only changes the counts
+        self.delete(1, 2)
+        self.assertEqual(self.summary(), (2, 1, 1, 0, 1))
+        # the last one is found again among the remaining episodes
+        self.delete(2, 1)
+        self.assertEqual(self.summary(), (1, 1, 0, 0, 1))
+        self.delete(1, 1)
+        self.assertEqual(self.summary(), (None, None, 0, 0, 0))
+
+    def test_delete_falls_back_to_the_history(self):
+        self.add(1, 3, STATUS_COMPLETE, completed=0)
+        self.add(1, 4, STATUS_INCOMPLETE)
+        self.fetcher.archive(1)
+        self.delete(1, 4)
+        self.assertEqual(self.summary(), (1, 3, 0, 0, 0))
+
+    def test_archive(self):
+        self.add(1, 1, STATUS_COMPLETE, completed=0)
+        self.add(1, 2, STATUS_COMPLETE, completed=time.time())
+        self.add(1, 3, STATUS_SEEDING)
+        self.fetcher.archive(1)
+        self.assertEqual(self.db.execute(
+            'select season, episode from history').fetchall(), [(1, 1)])
+        # the last episode stays, and archived ones no longer count
+        self.assertEqual(self.summary(), (1, 3, 0, 1, 1))
+        # nor does the last episode go once it is archived itself
+        self.set_status(1, 3, STATUS_COMPLETE)
+        self.db.execute('update shows set completed=0')
+        self.fetcher.archive(1)
+        self.assertEqual(self.summary(), (1, 3, 0, 0, 0))
+
+    def test_reset_show(self):
+        self.add(1, 1, STATUS_COMPLETE, completed=0)
+        self.add(1, 2, STATUS_INCOMPLETE)
+        self.add(3, 1, STATUS_INCOMPLETE, cfg_name='Other')
+        self.fetcher.archive(1)
+        self.fetcher.reset_show('Show')
+        self.assertIsNone(self.summary())
+        self.assertEqual(self.summary('Other'), (3, 1, 1, 0, 0))
+        # the show starts again from scratch
+        self.add(1, 1, STATUS_INCOMPLETE)
+        self.assertEqual(self.summary(), (1, 1, 1, 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import hashlib
+import sys
+import unittest
+
+from helpers import tvfetch
+
+INFO = b'd6:lengthi1024e4:name8:show.avi6:pieces20:' + b'x' * 20 + b'e'
+
+
+def torrent(info):
+    return b'd8:announce3:url4:info' + info + b'e'
+
+
+class ReadTorrentTest(unittest.TestCase):
+    def test_single_file(self):
+        meta = tvfetch.read_torrent(torrent(INFO))
+        self.assertEqual(meta.name, 'show.avi')
+        self.assertEqual(meta.files, [('show.avi', 1024)])
+        self.assertEqual(meta.infohash, hashlib.sha1(INFO).hexdigest())
+
+    def test_multiple_files(self):
+        info = (b'd5:filesld6:lengthi5e4:pathl3:dir5:a.aviee'
+                b'd6:lengthi7e4:pathl5:b.nfoeee4:name4:showe')
+        meta = tvfetch.read_torrent(torrent(info))
+        self.assertEqual(meta.name, 'show')
+        self.assertEqual(meta.files, [('dir/a.avi', 5), ('b.nfo', 7)])
+
+    def assertInvalid(self, data):
+        with self.assertRaises(tvfetch.BencodeError):
+            tvfetch.read_torrent(data)
+
+    def test_no_info(self):
+        self.assertInvalid(b'd8:announce3:urle')
+
+    def test_no_name(self):
+        self.assertInvalid(torrent(b'd6:lengthi1024ee'))
+
+    def test_name_not_a_string(self):
+        self.assertInvalid(torrent(b'd6:lengthi1024e4:namei5ee'))
+
+    def test_truncated(self):
+        data = torrent(INFO)
+        for end in (0, 1, 10, len(data) // 2, len(data) - 2):
+            self.assertInvalid(data[:end])
+
+    def test_string_past_the_end(self):
+        self.assertInvalid(torrent(b'd4:name99:showe'))
+
+    def test_not_a_dictionary(self):
+        self.assertInvalid(b'l4:infoe')
+        self.assertInvalid(torrent(b'l4:namee'))
+
+    def test_bad_integer(self):
+        self.assertInvalid(torrent(b'd6:lengthixe4:name1:ae'))
+
+    def test_deeply_nested(self):
+        # skipped values are walked recursively
+        depth = sys.getrecursionlimit() * 2
+        self.assertInvalid(torrent(b'd1:x' + b'l' * depth + b'e' * depth +
+                                   b'4:name1:ae'))
+        self.assertInvalid(b'd1:x' + b'l' * depth + b'e' * depth +
+                           b'4:info' + INFO + b'e')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,41 +1,99 @@
 #!/usr/bin/env python
 
 import base64
+import calendar
+import collections
+import concurrent.futures
 import configparser
+import contextlib
+import email.utils
 import errno
+import functools
+import glob
 import gzip
 import hashlib
+import heapq
+import importlib
 import io
+import json
 import logging
+import multiprocessing
 import os
+import random
+import re
+import select
 import shutil
 import signal
+import socket
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from logging import handlers
 from argparse import ArgumentParser
-from urllib.request import Request, urlopen
-from urllib.parse import urlencode
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
+from http.client import (HTTPConnection, HTTPSConnection, HTTPException,
+                         RemoteDisconnected)
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote_plus, urlencode, urljoin, urlsplit
 from urllib.error import HTTPError
+from xml.etree import ElementTree
 
-import bencodepy
-from bencodepy.exceptions import DecodingError
-import feedparser
 import sqlite3
-import transmissionrpc
-from pytvdbapi import api as tvdb_api
-from pytvdbapi import error as tvdb_error
+
+
+class LazyModule(object):
+    # Stands in for a module, which is only imported once one of its
+    # attributes is used. Setting an attribute sets it on the module.
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return '<lazy module %r>' % self._name
+
+
+# slow to import, and not needed by every command
+feedparser = LazyModule('feedparser')
+transmissionrpc = LazyModule('transmissionrpc')
+tvdb_api = LazyModule('pytvdbapi.api')
+tvdb_error = LazyModule('pytvdbapi.error')
 
 
 class UserError(Exception):
     pass
 
+
+class ShowError(Exception):
+    pass  # a show could not be checked for new episodes
+
+
+class TransmissionUnavailable(Exception):
+    pass  # transmission can't be reached, see CircuitBreaker
+
 # constants
 NAME = 'tvfetch'
 DEFAULT_DB_PATH = os.path.join(sys.prefix, 'var/{}/db.sqlite'.format(NAME))
 STATUS_COMPLETE = 'C'
 STATUS_INCOMPLETE = 'I'
 STATUS_SEEDING = 'S'
+# done seeding, until transmission has removed the torrent (see _clean_up)
+STATUS_REMOVING = 'R'
 SHOW_DEFAULTS = {
     'quality': 'HDTV',
     'seed_ratio': 1,
@@ -43,6 +101,8 @@ SHOW_DEFAULTS = {
     'start_episode': 1,
     'exclude_extensions': '',
     'max_concurrent': 2,
+    'feed_format': 'ezrss',
+    'feed_sources': 'ezrss',
 }
 LOG_FORMAT = '%(levelname)s: %(message)s'
 FILE_LOG_FORMAT = '%(asctime)s: ' + LOG_FORMAT
@@ -56,8 +116,161 @@ LOG_LEVELS = {
     'critical': logging.CRITICAL
 }
 DEFAULT_CONFIG_FILE = '/etc/%s.conf' % NAME
+ALL_SHOWS = object()  # --refresh-tvdb without a show name
+TORRENT_FROM_ENV = object()  # --notify-done without a torrent id
+SOURCE_PREFIX = 'source:'  # config sections for feed sources
 
 feed_url = 'http://ezrss.it/search/'
+# Database schema migrations. Each entry upgrades the schema by one version
+# (tracked in sqlite's user_version) and is applied in a single transaction.
+# Statements are separated by semicolons. Only ever append to this list.
+MIGRATIONS = [
+    # 1: initial schema
+    'create table if not exists shows(name text, season integer, '
+    'episode integer, title text, status text, url text, transid integer, '
+    'cfg_name text)',
+
+    # 2: conditional-GET cache of parsed season feeds, keyed by feed url
+    'create table if not exists feeds(url text primary key, etag text, '
+    'modified text, entries text)',
+
+    # 3: TVDB series/season structure, keyed by show section
+    'create table if not exists tvdb(cfg_name text primary key, '
+    'series_id integer, series_name text, seasons text, updated real, '
+    'stale integer default 0)',
+
+    # 4: indexes for the find_new/check_progress lookups. Older versions could
+    # record an episode twice, so keep only the first row for each.
+    'delete from shows where rowid not in ('
+    '    select min(rowid) from shows group by cfg_name, season, episode); '
+    'create unique index shows_episode on shows(cfg_name, season, episode); '
+    'create index shows_status on shows(status, cfg_name); '
+    'create index shows_transid on shows(transid)',
+
+    # 5: torrents we decided not to download, so they are never fetched again
+    'create table rejected(url text primary key, cfg_name text, '
+    'reason text); '
+    'create index rejected_cfg_name on rejected(cfg_name)',
+
+    # 6: infohash of each torrent, to spot the same torrent in other feeds
+    'alter table shows add column infohash text; '
+    'create index shows_infohash on shows(infohash)',
+
+    # 7: feed entries each show has already evaluated (see SeenEntries)
+    'create table seen(cfg_name text, guid text, published real, '
+    '    primary key (cfg_name, guid)); '
+    'create table watermarks(cfg_name text primary key, published real)',
+
+    # 8: shows claimed by worker processes sharing the database, and the
+    # workers that are alive (see Leases)
+    'create table leases(cfg_name text primary key, owner text, '
+    '    expires real, heartbeat real); '
+    'create index leases_owner on leases(owner); '
+    'create table workers(owner text primary key, expires real)',
+
+    # 9: torrents waiting to be added to transmission (see send_outbox)
+    'create table outbox(id integer primary key, cfg_name text, '
+    '    name text, season integer, episode integer, title text, url text, '
+    '    infohash text, torrent blob); '
+    'create index outbox_cfg_name on outbox(cfg_name)',
+
+    # 10: the watermark cached feed entries were read with; older entries
+    # were left out (see read_feed)
+    'alter table feeds add column since real',
+
+    # 11: a summary of each show's episodes, kept up to date by triggers in
+    # the same transaction as every change to the shows table, and the
+    # history that old complete episodes are archived to (see archive)
+    'alter table shows add column completed real; '
+    'create table history(cfg_name text, season integer, episode integer, '
+    '    infohash text, completed real, '
+    '    primary key (cfg_name, season, episode)) without rowid; '
+    'create index history_infohash on history(infohash); '
+    'create table show_summary(cfg_name text primary key, '
+    '    last_season integer, last_episode integer, '
+    '    incomplete integer default 0, seeding integer default 0, '
+    '    complete integer default 0); '
+    "insert into show_summary (cfg_name, last_season, incomplete, seeding, "
+    "    complete) select cfg_name, max(season), sum(status='I'), "
+    "    sum(status='S'), sum(status='C') from shows group by cfg_name; "
+    'update show_summary set last_episode=(select max(episode) from shows '
+    '    where cfg_name=show_summary.cfg_name and '
+    '    season=show_summary.last_season); '
+    'create trigger shows_insert after insert on shows begin '
+    '    insert or ignore into show_summary (cfg_name) '
+    '        values (new.cfg_name); '
+    "    update show_summary set incomplete=incomplete + (new.status='I'), "
+    "        seeding=seeding + (new.status='S'), "
+    "        complete=complete + (new.status='C') "
+    '        where cfg_name=new.cfg_name; '
+    '    update show_summary set last_season=new.season, '
+    '        last_episode=new.episode where cfg_name=new.cfg_name and ('
+    '        last_season is null or new.season>last_season or ('
+    '        new.season=last_season and new.episode>last_episode)); '
+    'end; '
+    'create trigger shows_status after update of status on shows begin '
+    "    update show_summary set incomplete=incomplete "
+    "        + (new.status='I') - (old.status='I'), "
+    "        seeding=seeding + (new.status='S') - (old.status='S'), "
+    "        complete=complete + (new.status='C') - (old.status='C') "
+    '        where cfg_name=new.cfg_name; '
+    'end; '
+    'create trigger shows_delete after delete on shows begin '
+    "    update show_summary set incomplete=incomplete - (old.status='I'), "
+    "        seeding=seeding - (old.status='S'), "
+    "        complete=complete - (old.status='C') "
+    '        where cfg_name=old.cfg_name; '
+    '    update show_summary set (last_season, last_episode)=('
+    '        select season, episode from ('
+    '            select * from (select season, episode from shows '
+    '                where cfg_name=old.cfg_name '
+    '                order by season desc, episode desc limit 1) '
+    '            union all '
+    '            select * from (select season, episode from history '
+    '                where cfg_name=old.cfg_name '
+    '                order by season desc, episode desc limit 1)) '
+    '        order by season desc, episode desc limit 1) '
+    '        where cfg_name=old.cfg_name and last_season=old.season and '
+    '        last_episode=old.episode; '
+    'end',
+
+    # 12: a watermark for each feed url instead of each show, since sources
+    # list different entries. Entries are evaluated once more.
+    'drop table watermarks; '
+    'create table watermarks(cfg_name text, url text, published real, '
+    '    primary key (cfg_name, url)); '
+    'alter table seen add column url text; '
+    'delete from seen',
+
+    # 13: how many times each show has been reset with --reset-show, so
+    # that running daemons know to drop what they have cached about it
+    'create table resets(cfg_name text primary key, count integer)',
+]
+
+# torrent fields requested from transmission in check_progress
+TORRENT_FIELDS = ['id', 'status', 'sizeWhenDone', 'leftUntilDone',
+                  'uploadRatio', 'downloadDir', 'files', 'priorities',
+                  'wanted']
+# feed entry fields kept in the feed cache
+FEED_ENTRY_KEYS = ('id', 'link', 'summary', 'title', 'enclosures',
+                   'torrent_infohash', 'torrent_magneturi')
+# linux ioctl that makes a file share another file's data blocks (reflink)
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 1048576
+# os.link errors meaning we should copy the file instead
+LINK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EACCES, errno.EMLINK,
+               errno.ENOTSUP)
+MAGNET_HASH_RE = re.compile(r'xt=urn:btih:([0-9a-zA-Z]+)')
+# ezrss summaries, eg: 'Show Name: Dexter; Episode Title: My Bad; Season: 5;
+# Episode: 1'
+EZRSS_FIELD_RE = re.compile(
+    r'(Show Name|Episode Title|Season|Episode):\s*([^;]*)')
+# release names, eg: 'Dexter S05E01 720p HDTV' or 'Dexter.5x01.HDTV'. Only the
+# first episode of multi-episode releases (S05E01E02) is used.
+TITLE_EPISODE_RE = re.compile(
+    r'(?P<show>.*?)[\s._-]*\b(?:[Ss](?P<season>\d{1,3})[\s._-]*'
+    r'[Ee](?P<episode>\d{1,3})(?:-?[Ee]\d{1,3})*'
+    r'|(?P<season_x>\d{1,2})[xX](?P<episode_x>\d{1,3}))\b')
 
 log = logging.getLogger('%s_log' % NAME)
 
@@ -107,15 +320,1466 @@ class Config(object):
     def sections(self):
         return self.config.sections()
 
+    def show_sections(self):
+        builtins = ('daemon', 'transmission', 'defaults', 'tvdb')
+        return [s for s in self.config.sections()
+                if s not in builtins and not s.startswith(SOURCE_PREFIX)]
+
+    def sources(self):
+        # {name: FeedSource} for the built-in ezrss source and every
+        # [source:NAME] section
+        timeout = float(self.get('daemon', 'feed_timeout', 30))
+        sources = {'ezrss': FeedSource('ezrss', None, None, timeout, False)}
+        for section in self.config.sections():
+            if not section.startswith(SOURCE_PREFIX):
+                continue
+            name = section[len(SOURCE_PREFIX):]
+            source = self.items(section)
+            if not source.get('url'):
+                raise UserError('No url for feed source "%s"' % name)
+            # catch bad url templates here rather than in the middle of a
+            # check (see TvFetch._feed_url)
+            try:
+                source['url'] % {'show_name': 'show', 'quality': 'HDTV',
+                                 'season': 1}
+            except (KeyError, TypeError, ValueError) as e:
+                raise UserError('Invalid url for feed source "%s": %s (%s)'
+                                % (name, source['url'], e))
+            if source.get('format') not in (None,) + tuple(FEED_FORMATS):
+                raise UserError('Unknown format for feed source "%s": %s'
+                                % (name, source['format']))
+            try:
+                sources[name] = FeedSource(
+                    name, source['url'], source.get('format'),
+                    float(source.get('timeout', timeout)),
+                    _flag(source.get('newest_first', 'false')))
+            except ValueError as e:
+                raise UserError('Invalid setting for feed source "%s": %s'
+                                % (name, e))
+        return sources
+
+    def shows(self):
+        # Compiles every show section, so values are only parsed once per
+        # config load. Returns {cfg_name: ShowSettings}.
+        defaults = self._show_defaults()
+        sources = self.sources()
+        return dict((cfg_name, self.show(cfg_name, defaults, sources))
+                    for cfg_name in self.show_sections())
+
+    def _show_defaults(self):
+        defaults = self.items('defaults', SHOW_DEFAULTS)
+        defaults.setdefault('check_time',
+                            self.get('daemon', 'check_time', 30))
+        return defaults
+
+    def show(self, cfg_name, defaults=None, sources=None):
+        # ShowSettings for a show section
+        if defaults is None:
+            defaults = self._show_defaults()
+        if sources is None:
+            sources = self.sources()
+        show = self.items(cfg_name, defaults)
+        name = show.get('name', cfg_name)
+        exclude = show['exclude_extensions'].split(',')
+        if show['feed_format'] not in FEED_FORMATS:
+            raise UserError('Unknown feed_format for show "%s": %s'
+                            % (cfg_name, show['feed_format']))
+        feed_sources = []
+        for source in show['feed_sources'].split(','):
+            source = source.strip()
+            if source not in sources:
+                raise UserError('Unknown feed source for show "%s": %s'
+                                % (cfg_name, source))
+            feed_sources.append(sources[source])
+        try:
+            return ShowSettings(
+                cfg_name=cfg_name,
+                name=name,
+                feed_search=show.get('feed_search', name),
+                feed_search_exact=_flag(show.get('feed_search_exact')),
+                quality=show.get('quality'),
+                seed_ratio=float(show['seed_ratio']),
+                start_season=int(show['start_season']),
+                start_episode=int(show['start_episode']),
+                exclude_extensions=frozenset(
+                    e.strip() for e in exclude if e.strip()),
+                max_concurrent=int(show['max_concurrent']),
+                destination=show.get('destination'),
+                tvdb_id=show.get('tvdb_id'),
+                paused=_flag(show.get('paused')),
+                check_time=float(show['check_time']) * 60,
+                feed_format=show['feed_format'],
+                feed_sources=tuple(feed_sources),
+            )
+        except ValueError as e:
+            raise UserError('Invalid setting for show "%s": %s'
+                            % (cfg_name, e))
+
+
+# A show section's settings, with defaults applied and values converted.
+# check_time is in seconds.
+ShowSettings = collections.namedtuple('ShowSettings', [
+    'cfg_name', 'name', 'feed_search', 'feed_search_exact', 'quality',
+    'seed_ratio', 'start_season', 'start_episode', 'exclude_extensions',
+    'max_concurrent', 'destination', 'tvdb_id', 'paused', 'check_time',
+    'feed_format', 'feed_sources'])
+
+# Show settings that decide which feed entries are wanted and which tvdb
+# series a show is. Entries skipped and series looked up under the old
+# values don't hold once they change.
+LOOKUP_SETTINGS = ('name', 'feed_search', 'feed_search_exact', 'quality',
+                   'start_season', 'start_episode', 'exclude_extensions',
+                   'tvdb_id', 'feed_format', 'feed_sources')
+
+# A feed indexer. url is a template for season feed urls, or None for the
+# built-in ezrss source, and format the name of its FeedFormat (None for the
+# show's feed_format). timeout is in seconds.
+FeedSource = collections.namedtuple(
+    'FeedSource', 'name url format timeout newest_first')
+
+
+def _flag(value):
+    # boolean config values; anything but empty/false/no/off/0 is true
+    return bool(value) and value.lower() not in ('false', 'no', 'off', '0')
+
+
+class BencodeError(ValueError):
+    pass
+
+
+# name, [(path, length), ...] and hex infohash of a .torrent file
+TorrentMeta = collections.namedtuple('TorrentMeta', 'name files infohash')
+
+
+def _bencode_skip(buf, i):
+    # Returns the index just past the bencoded value starting at i, without
+    # decoding (or copying) anything.
+    c = buf[i]
+    if c == 0x69:  # i<number>e
+        return buf.index(b'e', i) + 1
+    elif c == 0x6c or c == 0x64:  # l...e or d...e
+        i += 1
+        while buf[i] != 0x65:
+            i = _bencode_skip(buf, i)
+        return i + 1
+    else:  # <length>:<bytes>
+        colon = buf.index(b':', i)
+        return colon + 1 + int(buf[i:colon])
+
+
+def _bencode_decode(buf, i):
+    # Decodes the (small) value starting at i. Returns (value, end index).
+    c = buf[i]
+    if c == 0x69:
+        end = buf.index(b'e', i)
+        return int(buf[i + 1:end]), end + 1
+    elif c == 0x6c:
+        i += 1
+        result = []
+        while buf[i] != 0x65:
+            value, i = _bencode_decode(buf, i)
+            result.append(value)
+        return result, i + 1
+    elif c == 0x64:
+        i += 1
+        result = {}
+        while buf[i] != 0x65:
+            key, i = _bencode_decode(buf, i)
+            result[key], i = _bencode_decode(buf, i)
+        return result, i + 1
+    else:
+        colon = buf.index(b':', i)
+        end = colon + 1 + int(buf[i:colon])
+        if end > len(buf):
+            raise BencodeError('string runs past the end of the data')
+        return buf[colon + 1:end], end
+
+
+def _bencode_dict(buf, i):
+    # Yields (key, value start, value end) for the dict starting at i,
+    # leaving the values themselves undecoded.
+    if buf[i] != 0x64:
+        raise BencodeError('expected a dictionary at offset %d' % i)
+    i += 1
+    while buf[i] != 0x65:
+        key, i = _bencode_decode(buf, i)
+        end = _bencode_skip(buf, i)
+        yield key, i, end
+        i = end
+
+
+def read_torrent(data):
+    # Reads the name, file list and infohash from .torrent data. Only the
+    # fields we need are decoded; everything else, notably the (large)
+    # "pieces" string, is skipped over in place.
+    try:
+        for key, start, end in _bencode_dict(data, 0):
+            if key == b'info':
+                break
+        else:
+            raise BencodeError('torrent has no info dictionary')
+
+        name = None
+        files = None
+        length = None
+        for key, i, j in _bencode_dict(data, start):
+            if key == b'name':
+                name = _bencode_decode(data, i)[0].decode()
+            elif key == b'length':
+                length = _bencode_decode(data, i)[0]
+            elif key == b'files':
+                files = [
+                    ('/'.join(p.decode() for p in f[b'path']), f[b'length'])
+                    for f in _bencode_decode(data, i)[0]
+                ]
+        # the name is needed to tell which file to keep
+        if name is None:
+            raise BencodeError('torrent has no name')
+        if files is None:
+            files = [(name, length)]
+        infohash = hashlib.sha1(memoryview(data)[start:end]).hexdigest()
+    except BencodeError:
+        raise
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError,
+            RecursionError) as e:
+        # RecursionError: lists or dicts nested too deep to decode
+        raise BencodeError('Invalid torrent data: %s' % e)
+    return TorrentMeta(name, files, infohash)
+
+
+class Metrics(object):
+    # Counters, gauges and latency histograms, rendered in the Prometheus
+    # text format. Safe to use from any thread.
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+               60, 120, 300)
+    # name: (type, help)
+    METRICS = {
+        'phase_seconds': ('histogram', 'Time spent in each phase'),
+        'show_seconds': ('counter', 'Time spent on feeds and tvdb data '
+                         'for each show'),
+        'cycle_seconds': ('histogram', 'Duration of find_new, '
+                          'check_progress and send_outbox runs'),
+        'torrents': ('gauge', 'Tracked torrents by status'),
+        'placements_pending': ('gauge', 'Files waiting to be placed'),
+        'episodes_added': ('counter', 'Episodes added to transmission'),
+        'outbox_pending': ('gauge',
+                           'Torrents waiting to be added to transmission'),
+        'feeds_not_modified': ('counter', 'Feeds answered with 304'),
+        'torrent_cache_hits': ('counter', 'Torrents read from the cache'),
+        'errors': ('counter', 'Errors by phase'),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._histograms = {}
+
+    def _key(self, name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            # cumulative bucket counts, then sum and count
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(self.BUCKETS) + 2)
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    hist[i] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    @contextlib.contextmanager
+    def phase(self, phase, show=None, **labels):
+        # The time is also added to the show's total. Histograms are only
+        # kept per phase, as one per show would be too big to render.
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            self.observe('phase_seconds', elapsed, phase=phase, **labels)
+            if show is not None:
+                self.inc('show_seconds', elapsed, show=show)
+
+    @contextlib.contextmanager
+    def cycle(self, cycle):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe('cycle_seconds', time.monotonic() - start,
+                         cycle=cycle)
+
+    def _format_labels(self, labels):
+        if not labels:
+            return ''
+        escape = lambda v: (str(v).replace('\\', '\\\\')
+                            .replace('"', '\\"').replace('\n', '\\n'))
+        return '{%s}' % ','.join('%s="%s"' % (k, escape(v))
+                                 for k, v in labels)
+
+    def snapshot(self):
+        # Copies of the current values: ({(name, labels): value}, {(name,
+        # labels): [cumulative bucket counts..., sum, count]}), where labels
+        # is a sorted tuple of (label, value) pairs.
+        with self._lock:
+            values = dict(self._values)
+            histograms = dict((k, list(v))
+                              for k, v in self._histograms.items())
+        return values, histograms
+
+    def render(self):
+        values, histograms = self.snapshot()
+        lines = []
+        for name in sorted(self.METRICS):
+            kind, help = self.METRICS[name]
+            full_name = '%s_%s' % (NAME, name)
+            if kind == 'counter':
+                full_name += '_total'
+            lines.append('# HELP %s %s' % (full_name, help))
+            lines.append('# TYPE %s %s' % (full_name, kind))
+            if kind != 'histogram':
+                for (n, labels), value in sorted(values.items()):
+                    if n == name:
+                        lines.append('%s%s %s' % (
+                            full_name, self._format_labels(labels), value))
+                continue
+            for (n, labels), hist in sorted(histograms.items()):
+                if n != name:
+                    continue
+                buckets = ['%g' % b for b in self.BUCKETS] + ['+Inf']
+                counts = hist[:len(self.BUCKETS)] + [hist[-1]]
+                for bound, count in zip(buckets, counts):
+                    lines.append('%s_bucket%s %d' % (
+                        full_name,
+                        self._format_labels(labels + (('le', bound),)),
+                        count))
+                lines.append('%s_sum%s %f' % (
+                    full_name, self._format_labels(labels), hist[-2]))
+                lines.append('%s_count%s %d' % (
+                    full_name, self._format_labels(labels), hist[-1]))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    # serves server.metrics at /metrics
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug('metrics: ' + format % args)
+
+
+class HTTPPool(object):
+    # Keep-alive HTTP connections shared between threads. Each connection is
+    # only used by one request at a time and returned to the pool afterwards.
+    def __init__(self, timeout=60, max_idle=4):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, scheme, netloc):
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        if scheme == 'https':
+            return HTTPSConnection(netloc, timeout=self.timeout)
+        return HTTPConnection(netloc, timeout=self.timeout)
+
+    def _release(self, scheme, netloc, conn):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _send(self, conn, path, headers):
+        try:
+            conn.request('GET', path, headers=headers)
+            return conn.getresponse()
+        except (RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # the server closed an idle connection, so try a fresh one
+            conn.close()
+            conn.request('GET', path, headers=headers)
+            return conn.getresponse()
+
+    def _finish(self, scheme, netloc, conn, response):
+        # a connection can only be reused once its response has been read
+        if response.isclosed() and not response.will_close:
+            self._release(scheme, netloc, conn)
+        else:
+            conn.close()
+
+    @contextlib.contextmanager
+    def stream(self, url, headers=None, max_redirects=5, timeout=None):
+        # Yields (status, headers, body file) once the response headers have
+        # arrived, so that the body can be read as it comes in. Redirects
+        # are followed and gzipped bodies decompressed as they are read;
+        # error responses raise HTTPError. The connection goes back to the
+        # pool if the body was read to the end, and is closed otherwise.
+        # timeout overrides the pool's socket timeout for this request.
+        request_headers = {'Accept-Encoding': 'gzip', 'User-Agent': NAME}
+        request_headers.update(headers or {})
+        for i in range(max_redirects + 1):
+            parts = urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            conn = self._acquire(parts.scheme, parts.netloc)
+            conn.timeout = timeout or self.timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(conn.timeout)
+            try:
+                response = self._send(conn, path, request_headers)
+                # only successful responses are worth streaming
+                body = response
+                if response.status != 200:
+                    body = io.BytesIO(response.read())
+            except:
+                conn.close()
+                raise
+
+            location = response.getheader('Location')
+            if (response.status in (301, 302, 303, 307, 308) and location
+                    or response.status >= 400):
+                self._finish(parts.scheme, parts.netloc, conn, response)
+                if response.status >= 400:
+                    raise HTTPError(url, response.status, response.reason,
+                                    response.headers, None)
+                url = urljoin(url, location)
+                continue
+            if response.getheader('Content-Encoding') == 'gzip':
+                body = gzip.GzipFile(fileobj=body, mode='rb')
+            try:
+                yield response.status, response.headers, body
+            finally:
+                self._finish(parts.scheme, parts.netloc, conn, response)
+            return
+        raise HTTPError(url, response.status, 'Too many redirects',
+                        response.headers, None)
+
+    def get(self, url, headers=None, max_redirects=5, timeout=None):
+        # Returns (status, headers, body), with the whole body read (see
+        # stream).
+        with self.stream(url, headers, max_redirects, timeout) as (
+                status, response_headers, body):
+            return status, response_headers, body.read()
+
+
+class TorrentCache(object):
+    # Content-addressed store of downloaded .torrent files. Each torrent is
+    # saved once as <infohash>.torrent, and urls/<sha1 of url> records the
+    # infohash a url returned. The least recently used torrents are evicted
+    # once the cache grows beyond max_size bytes.
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        # other workers may be creating it at the same time
+        os.makedirs(os.path.join(path, 'urls'), 0o770, exist_ok=True)
+
+    def _url_path(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.path, 'urls', key)
+
+    def _torrent_path(self, infohash):
+        return os.path.join(self.path, infohash + '.torrent')
+
+    def _write(self, path, data):
+        # write to a temporary file first, so readers never see partial data
+        tmp_path = '%s.%d-%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, url):
+        try:
+            with open(self._url_path(url)) as f:
+                infohash = f.read().strip()
+            path = self._torrent_path(infohash)
+            with open(path, 'rb') as f:
+                data = f.read()
+            # mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data, infohash
+
+    def put(self, url, data, infohash):
+        self._write(self._torrent_path(infohash), data)
+        self._write(self._url_path(url), infohash.encode())
+
+    def evict(self):
+        # Worker processes share the cache and may evict at the same time,
+        # so files can disappear at any point. Files still being written
+        # (*.tmp) are left alone.
+        torrents = []
+        for name in os.listdir(self.path):
+            if name.endswith('.torrent'):
+                path = os.path.join(self.path, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                torrents.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for mtime, size, path in torrents)
+        if total <= self.max_size:
+            return
+        for mtime, size, path in sorted(torrents):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            log.debug('Evicted %s from torrent cache' % path)
+
+        # drop urls whose torrent is gone
+        url_dir = os.path.join(self.path, 'urls')
+        for name in os.listdir(url_dir):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(url_dir, name)
+            try:
+                with open(path) as f:
+                    infohash = f.read().strip()
+                if not os.path.exists(self._torrent_path(infohash)):
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class TorrentFetcher(object):
+    # Downloads .torrent files through a shared connection pool and cache.
+    def __init__(self, cache, workers=4, pool=None, metrics=None):
+        self.cache = cache
+        self.workers = workers
+        self.pool = pool or HTTPPool()
+        self.metrics = metrics or Metrics()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def fetch(self, url):
+        # returns (data, TorrentMeta)
+        cached = self.cache.get(url)
+        if cached is not None:
+            self.metrics.inc('torrent_cache_hits')
+            data, infohash = cached
+            with self.metrics.phase('bencode'):
+                return data, read_torrent(data)
+        with self.metrics.phase('torrent_download'):
+            status, headers, data = self.pool.get(url)
+        with self.metrics.phase('bencode'):
+            torrent = read_torrent(data)
+        self.cache.put(url, data, torrent.infohash)
+        return data, torrent
+
+    def _result(self, item, future):
+        try:
+            return item, future.result(), None
+        except Exception as e:
+            return item, None, e
+
+    def prefetch(self, items):
+        # Takes (item, url) pairs and yields (item, (data, meta), error)
+        # in the same order, keeping up to `workers` downloads running ahead
+        # of the consumer. Items are only pulled from the iterable as they
+        # are needed, and downloads that haven't started when the consumer
+        # stops are cancelled.
+        pending = collections.deque()
+        try:
+            for item, url in items:
+                pending.append((item, self.executor.submit(self.fetch, url)))
+                if len(pending) >= self.workers:
+                    yield self._result(*pending.popleft())
+            while pending:
+                yield self._result(*pending.popleft())
+        finally:
+            for item, future in pending:
+                future.cancel()
+
+
+class HedgedRequest(object):
+    # Fetches the same data from several sources, in order of preference.
+    # The first source is asked right away, and each next one once all of
+    # the sources asked so far have failed or have taken longer than
+    # hedge_delay seconds. fetch(source) runs in the source's executor (from
+    # {source name: executor}) and returns None if the source failed; a
+    # source that takes longer than its timeout counts as failed, too.
+    def __init__(self, executors, fetch, sources, hedge_delay):
+        self.executors = executors
+        self.fetch = fetch
+        self.hedge_delay = hedge_delay
+        self._waiting = list(sources)
+        self._requests = []  # [source, future, start time]
+        self._start()
+
+    def _start(self):
+        request = [self._waiting.pop(0), None, None]
+
+        def run():
+            request[2] = time.monotonic()
+            try:
+                return self.fetch(request[0])
+            except Exception as e:
+                # fetch handles the errors it expects; anything else is
+                # logged here, as the source just counts as failed
+                log.exception('Could not fetch from source %s: %s'
+                              % (request[0].name, e))
+                raise
+        request[1] = self.executors[request[0].name].submit(run)
+        self._requests.append(request)
+
+    def cancel(self):
+        # gives up on the requests that haven't started yet
+        for source, future, started in self._requests:
+            future.cancel()
+
+    def _failed(self, request, now):
+        source, future, started = request
+        if future.done():
+            return future.exception() is not None or future.result() is None
+        return started is not None and now - started >= source.timeout
+
+    def _answered(self, now):
+        return [(source, future.result())
+                for source, future, started in self._requests
+                if future.done() and not self._failed(
+                    (source, future, started), now)]
+
+    def results(self):
+        # Waits until a source has answered, or all of them have failed.
+        # Returns [(source, result)] for every source that has answered by
+        # then, in order of preference.
+        while True:
+            now = time.monotonic()
+            if self._answered(now):
+                break
+            running = [r for r in self._requests if not self._failed(r, now)]
+            if not running and not self._waiting:
+                break
+            if self._waiting and all(
+                    started is not None and now - started >= self.hedge_delay
+                    for source, future, started in running):
+                self._start()
+                continue
+
+            # sleep until something finishes, times out or is due a hedge.
+            # Requests still queued in the executor are polled for.
+            wake = []
+            for source, future, started in running:
+                if started is None:
+                    wake.append(now + 0.1)
+                    continue
+                wake.append(started + source.timeout)
+            if self._waiting and all(started is not None
+                                     for source, future, started in running):
+                # the next hedge waits for the last source asked
+                wake.append(max(started for source, future, started
+                                in running) + self.hedge_delay)
+            concurrent.futures.wait(
+                [future for source, future, started in running],
+                timeout=max(0, min(wake) - now),
+                return_when=concurrent.futures.FIRST_COMPLETED)
+        return self._answered(time.monotonic())
+
+
+class CircuitBreaker(object):
+    # Stops calling a service that is down. After max_failures failures in
+    # a row the circuit opens, and allow() refuses calls for retry_interval
+    # seconds. Then one call is let through: if it works the circuit closes
+    # again, otherwise it stays open for twice as long, up to max_interval.
+    def __init__(self, name, max_failures=3, retry_interval=30,
+                 max_interval=600):
+        self.name = name
+        self.max_failures = max_failures
+        self.retry_interval = retry_interval
+        self.max_interval = max_interval
+        self.failures = 0
+        self.interval = retry_interval
+        self.retry_at = None  # while the circuit is open
+
+    def allow(self):
+        return self.retry_at is None or time.time() >= self.retry_at
+
+    def success(self):
+        if self.retry_at is not None:
+            log.info('%s is available again' % self.name)
+        self.failures = 0
+        self.interval = self.retry_interval
+        self.retry_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.retry_at is not None:
+            # the trial call failed
+            self.interval = min(self.interval * 2, self.max_interval)
+        elif self.failures < self.max_failures:
+            return
+        self.retry_at = time.time() + self.interval
+        log.warning('%s is unavailable, trying again in %d seconds' % (
+            self.name, self.interval))
+
+
+def normalize_infohash(infohash):
+    # lower-case hex infohash from a hex or base32 (magnet link) one
+    if len(infohash) == 32:
+        try:
+            infohash = base64.b32decode(infohash.upper()).hex()
+        except ValueError:
+            return None
+    if len(infohash) != 40:
+        return None
+    return infohash.lower()
+
+
+def entry_infohash(entry):
+    # Infohash advertised by a feed entry, if any, so that torrents we
+    # already have can be skipped without downloading them.
+    if entry.get('torrent_infohash'):
+        return normalize_infohash(entry['torrent_infohash'])
+    uris = [entry.get('torrent_magneturi'), entry.get('link')]
+    uris += [e.get('href') for e in entry.get('enclosures', [])]
+    for uri in uris:
+        match = uri and MAGNET_HASH_RE.search(uri)
+        if match:
+            return normalize_infohash(match.group(1))
+    return None
+
+
+def _feed_time(name, value):
+    # publish time of a feed entry in epoch seconds, from an RSS pubDate or
+    # an Atom published date. Times without a timezone are taken as UTC.
+    if name == 'pubDate':
+        parsed = email.utils.parsedate_tz(value)
+        return email.utils.mktime_tz(parsed) if parsed else None
+    try:
+        published = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if published.tzinfo is None:
+        published = published.replace(tzinfo=timezone.utc)
+    return published.timestamp()
+
+
+def _read_feed_field(entry, name, element):
+    # adds an RSS item or Atom entry child element to the entry dict
+    text = ''.join(element.itertext()).strip()
+    if name == 'title':
+        entry['title'] = text
+    elif name in ('description', 'summary'):
+        entry['summary'] = text
+    elif name == 'content':
+        entry.setdefault('summary', text)
+    elif name == 'link':
+        rel = element.get('rel', 'alternate')
+        if element.get('href') is None:
+            entry['link'] = text
+        elif rel == 'alternate':
+            entry['link'] = element.get('href')
+        elif rel == 'enclosure':
+            entry.setdefault('enclosures', []).append(dict(
+                (key, element.get(attr)) for key, attr in
+                (('href', 'href'), ('type', 'type'), ('length', 'length'))
+                if element.get(attr) is not None))
+    elif name == 'enclosure':
+        entry.setdefault('enclosures', []).append(dict(
+            (key, element.get(attr)) for key, attr in
+            (('href', 'url'), ('type', 'type'), ('length', 'length'))
+            if element.get(attr) is not None))
+    elif name in ('guid', 'id'):
+        entry['id'] = text
+        if name == 'guid' and element.get('isPermaLink') != 'false':
+            entry['permalink'] = text
+    elif name in ('pubDate', 'published'):
+        published = _feed_time(name, text)
+        if published is not None:
+            entry['published'] = published
+    elif name == 'infoHash':
+        entry['torrent_infohash'] = text
+    elif name == 'magnetURI':
+        entry['torrent_magneturi'] = text
+
+
+def read_feed(feed, since=None, newest_first=False):
+    # Reads the entries of an RSS or Atom feed (a file, or bytes) while it
+    # is being parsed, as dicts of FEED_ENTRY_KEYS plus their publish time,
+    # like the feed cache keeps them. Entries are dropped as soon as they
+    # have been read, so the whole document is never held in memory, and a
+    # file is only read as far as needed. Entries published before since
+    # are skipped, and for feeds that list the newest entries first, so is
+    # everything after the first of them. Raises ElementTree.ParseError if
+    # the feed isn't well-formed XML.
+    if isinstance(feed, bytes):
+        feed = io.BytesIO(feed)
+    depth = 0
+    stack = []  # open elements
+    entry = entry_depth = None
+    for event, element in ElementTree.iterparse(
+            feed, events=('start', 'end')):
+        name = element.tag.rsplit('}', 1)[-1]
+        if event == 'start':
+            depth += 1
+            stack.append(element)
+            if entry is None and name in ('item', 'entry') and depth > 1:
+                entry, entry_depth = {}, depth
+            continue
+
+        if entry is not None and depth == entry_depth + 1:
+            _read_feed_field(entry, name, element)
+        elif entry is not None and depth == entry_depth:
+            # the end of an entry
+            permalink = entry.pop('permalink', None)
+            if not entry.get('link') and permalink:
+                entry['link'] = permalink
+            published = entry.get('published')
+            if since is not None and published is not None and (
+                    published < since):
+                if newest_first:
+                    return
+            elif entry.get('link'):
+                yield entry
+            entry = None
+            # drop the entries read so far from their parent
+            del stack[-2][:]
+        depth -= 1
+        stack.pop()
+
+
+def feedparser_entries(data):
+    # the entries of a feed as read_feed gives them, using feedparser
+    entries = []
+    for e in feedparser.parse(data)['entries']:
+        entry = dict((k, e[k]) for k in FEED_ENTRY_KEYS if k in e)
+        if e.get('published_parsed'):
+            entry['published'] = calendar.timegm(e['published_parsed'])
+        if entry.get('link'):
+            entries.append(entry)
+    return entries
+
+
+def _copy_data(src, dst):
+    # Copies src to dst, sharing the data blocks (reflink) where the
+    # filesystem supports it, then copying inside the kernel with
+    # copy_file_range, and only then by reading and writing chunks.
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return 'reflink'
+            except OSError:
+                pass
+
+        if hasattr(os, 'copy_file_range'):
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    n = os.copy_file_range(
+                        fsrc.fileno(), fdst.fileno(), size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+            except OSError:
+                pass
+            if copied == size:
+                return 'copy_file_range'
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+
+        shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+        return 'copy'
+
+
+def place_file(src, dst, move=False):
+    # Puts src at dst as cheaply as possible. Moves are a rename when src
+    # and dst are on the same filesystem; copies are a hardlink if possible.
+    # Returns how the file was placed.
+    if move:
+        try:
+            os.replace(src, dst)
+            return 'rename'
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    else:
+        try:
+            if os.path.lexists(dst):
+                os.remove(dst)
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError as e:
+            if e.errno not in LINK_ERRORS:
+                raise
+
+    # copy to a temporary file first, so dst is never left half written
+    tmp_path = dst + '.part'
+    method = _copy_data(src, tmp_path)
+    shutil.copymode(src, tmp_path)
+    os.replace(tmp_path, dst)
+    if move:
+        os.remove(src)
+    return method
+
+
+def remove_torrent_files(download_dir, files):
+    # Deletes a torrent's files (paths relative to download_dir) and the
+    # top-level directories they are in. Files that are already gone are
+    # fine.
+    dirs = []
+    for file in files:
+        # The file path should be relative, but we'll do this to be safe.
+        file = os.path.normpath(file)
+        if os.path.isabs(file) or file.startswith(os.pardir):
+            continue
+        parts = file.split(os.sep)
+        if len(parts) > 1:
+            if parts[0] not in dirs:
+                dirs.append(parts[0])
+            continue
+        log.debug('Deleted %s' % file)
+        try:
+            os.remove(os.path.join(download_dir, file))
+        except FileNotFoundError:
+            pass
+
+    for dir in dirs:
+        log.debug('Deleted %s' % dir)
+        try:
+            shutil.rmtree(os.path.join(download_dir, dir))
+        except FileNotFoundError:
+            pass
+
+
+class FilePlacer(object):
+    # Runs place_file on a pool of background threads, so that slow copies
+    # don't hold up check_progress. Jobs are keyed by transmission id.
+    def __init__(self, workers=2, metrics=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.metrics = metrics or Metrics()
+        self._jobs = {}
+
+    def __contains__(self, key):
+        return key in self._jobs
+
+    def __iter__(self):
+        return iter(list(self._jobs))
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def _place(self, src, dst, move):
+        with self.metrics.phase('placement'):
+            return place_file(src, dst, move)
+
+    def submit(self, key, src, dst, move=False):
+        future = self.executor.submit(self._place, src, dst, move)
+        self._jobs[key] = (dst, future)
+
+    def wait(self, timeout=None):
+        # Blocks until every job has finished, or for at most timeout
+        # seconds. Returns True if some are still running.
+        return bool(concurrent.futures.wait(
+            [future for dst, future in self._jobs.values()], timeout)[1])
+
+    def done(self, key):
+        # (destination, future) once the job for key has finished, else None.
+        # Finished jobs are forgotten.
+        job = self._jobs.get(key)
+        if job is None or not job[1].done():
+            return None
+        del self._jobs[key]
+        return job
+
+    def discard(self, key):
+        # Forgets the job for key, eg. once its torrent is gone. It is
+        # cancelled if it hasn't started yet; otherwise its result is
+        # ignored.
+        job = self._jobs.pop(key, None)
+        if job is not None:
+            job[1].cancel()
+
+
+class Scheduler(object):
+    # Priority queue of the time each show is next due to be checked. Checks
+    # are spread out by a random jitter (a fraction of the interval), and
+    # shows that keep failing are checked exponentially less often, up to
+    # max_backoff seconds apart.
+    def __init__(self, jitter=0.1, max_backoff=21600):
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self._intervals = {}
+        self._failures = {}
+        self._deadlines = {}
+        self._queue = []
+
+    def _schedule(self, cfg_name, delay):
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        deadline = time.time() + delay
+        self._deadlines[cfg_name] = deadline
+        heapq.heappush(self._queue, (deadline, cfg_name))
+
+    def sync(self, intervals):
+        # Takes {cfg_name: interval in seconds}. New shows are due right away
+        # (spread over the jitter), removed ones are dropped.
+        for cfg_name in list(self._intervals):
+            if cfg_name not in intervals:
+                del self._intervals[cfg_name]
+                self._failures.pop(cfg_name, None)
+                self._deadlines.pop(cfg_name, None)
+        for cfg_name, interval in intervals.items():
+            if cfg_name not in self._intervals:
+                deadline = time.time() + random.uniform(
+                    0, self.jitter * interval)
+                self._deadlines[cfg_name] = deadline
+                heapq.heappush(self._queue, (deadline, cfg_name))
+            self._intervals[cfg_name] = interval
+
+    def due(self, now):
+        # pops the shows whose deadline has passed
+        due = []
+        while self._queue and self._queue[0][0] <= now:
+            deadline, cfg_name = heapq.heappop(self._queue)
+            # skip stale entries for rescheduled or removed shows
+            if self._deadlines.get(cfg_name) == deadline:
+                del self._deadlines[cfg_name]
+                due.append(cfg_name)
+        return due
+
+    def next_deadline(self):
+        while self._queue:
+            deadline, cfg_name = self._queue[0]
+            if self._deadlines.get(cfg_name) == deadline:
+                return deadline
+            heapq.heappop(self._queue)
+        return float('inf')
+
+    def done(self, cfg_name, ok):
+        # schedules the next check of a show that has just been checked
+        if cfg_name not in self._intervals:
+            return
+        interval = self._intervals[cfg_name]
+        if ok:
+            self._failures.pop(cfg_name, None)
+        else:
+            failures = self._failures[cfg_name] = (
+                self._failures.get(cfg_name, 0) + 1)
+            interval = max(interval, min(interval * 2 ** failures,
+                                         self.max_backoff))
+            log.debug('Backing off checks of "%s" for %d minutes' % (
+                cfg_name, interval / 60))
+        self._schedule(cfg_name, interval)
+
+
+def entry_key(entry):
+    # identifies a feed entry across checks
+    return entry.get('id') or entry['link']
+
+
+class FeedEntry(object):
+    # A feed entry, parsed by a FeedFormat. rank is the entry's position in
+    # its feed (feeds list the best torrents first), guid its entry_key and
+    # published its publish time (epoch seconds) if known. show, season,
+    # episode and title are None if the entry could not be parsed.
+    __slots__ = ('show', 'season', 'episode', 'title', 'link', 'rank',
+                 'infohash', 'guid', 'published')
+
+    def __init__(self, show, season, episode, title, link, rank, infohash,
+                 guid, published):
+        self.show = show
+        self.season = season
+        self.episode = episode
+        self.title = title
+        self.link = link
+        self.rank = rank
+        self.infohash = infohash
+        self.guid = guid
+        self.published = published
+
+    def __repr__(self):
+        return '<FeedEntry %s s%se%s %s>' % (
+            self.show, self.season, self.episode, self.link)
+
+
+class FeedFormat(object):
+    # Turns the entries of one kind of feed (dicts of FEED_ENTRY_KEYS) into
+    # FeedEntry records. Subclasses implement parse_episode, and are
+    # registered in FEED_FORMATS under the name used by the feed_format
+    # show setting.
+    def parse_episode(self, entry):
+        # returns (show, season, episode, title), or None
+        raise NotImplementedError
+
+    def parse(self, entry, rank):
+        info = self.parse_episode(entry) or (None, None, None, None)
+        return FeedEntry(*info, link=entry['link'], rank=rank,
+                         infohash=entry_infohash(entry),
+                         guid=entry_key(entry),
+                         published=entry.get('published'))
+
+
+class EzrssFormat(FeedFormat):
+    # ezrss.it feeds, which describe the episode in the entry summary
+    def parse_episode(self, entry):
+        fields = dict(EZRSS_FIELD_RE.findall(entry.get('summary', '')))
+        try:
+            season = int(fields['Season'])
+            episode = int(fields['Episode'])
+        except (KeyError, ValueError):
+            return None
+        return (fields.get('Show Name', '').strip() or None, season, episode,
+                fields.get('Episode Title', '').strip() or None)
+
+
+class TitleFormat(FeedFormat):
+    # feeds whose entry titles are release names, with the episode as
+    # S05E01 or 5x01
+    def parse_episode(self, entry):
+        match = TITLE_EPISODE_RE.match(entry.get('title', ''))
+        if match is None:
+            return None
+        show = re.sub(r'[._]', ' ', match.group('show')).strip()
+        season = match.group('season') or match.group('season_x')
+        episode = match.group('episode') or match.group('episode_x')
+        return show or None, int(season), int(episode), None
+
+
+FEED_FORMATS = {
+    'ezrss': EzrssFormat(),
+    'title': TitleFormat(),
+}
+
+
+class UnitOfWork(object):
+    # Database changes made during a find_new or check_progress cycle,
+    # written together in a single transaction by flush(). Consecutive runs
+    # of the same statement are sent with one executemany, and statements
+    # are applied in the order they were added.
+    def __init__(self, db):
+        self.db = db
+        self._batches = []  # [(sql, [params, ...]), ...]
+
+    def add(self, sql, params=()):
+        if self._batches and self._batches[-1][0] == sql:
+            self._batches[-1][1].append(params)
+        else:
+            self._batches.append((sql, [params]))
+
+    def flush(self):
+        batches, self._batches = self._batches, []
+        if not batches:
+            return
+        with self.db:
+            for sql, params in batches:
+                self.db.executemany(sql, params)
+
+    def __len__(self):
+        return sum(len(params) for sql, params in self._batches)
+
+
+class SeenEntries(object):
+    # Feed entries each show has already evaluated (added, skipped for good
+    # or rejected), so that they can be dropped before any parsing on later
+    # checks. Each feed url has its own watermark, as sources list different
+    # entries and are not always asked: every entry a feed listed before its
+    # watermark has been evaluated. Newer ones are remembered individually
+    # by entry_key, along with the feed they came from.
+    def __init__(self, db, writes):
+        self.db = db
+        self.writes = writes
+        self._shows = {}
+
+    def _load(self, cfg_name):
+        # [{url: watermark}, {guid: (url, published)}]
+        try:
+            return self._shows[cfg_name]
+        except KeyError:
+            c = self.db.cursor()
+            c.execute('select url, published from watermarks '
+                      'where cfg_name=?', (cfg_name,))
+            watermarks = dict(c)
+            c.execute('select guid, url, published from seen '
+                      'where cfg_name=?', (cfg_name,))
+            seen = dict((guid, (url, published))
+                        for guid, url, published in c)
+            state = self._shows[cfg_name] = [watermarks, seen]
+            return state
+
+    def watermark(self, cfg_name, url):
+        return self._load(cfg_name)[0].get(url)
+
+    def unseen(self, cfg_name, url, entries):
+        watermarks, seen = self._load(cfg_name)
+        watermark = watermarks.get(url)
+        return [e for e in entries
+                if not (watermark is not None and
+                        e.get('published') is not None and
+                        e['published'] < watermark)
+                and entry_key(e) not in seen]
+
+    def update(self, cfg_name, feeds, evaluated):
+        # Takes the unseen entries of a check, as [(url, [FeedEntry, ...])]
+        # for each feed, and the guids of those that were evaluated. A
+        # feed's watermark moves up to its oldest entry still to be looked
+        # at (or the newest one evaluated), never down.
+        watermarks, seen = self._load(cfg_name)
+        for url, entries in feeds:
+            watermark = watermarks.get(url)
+            pending = [e.published for e in entries
+                       if e.guid not in evaluated and e.published is not None]
+            done = [e.published for e in entries
+                    if e.guid in evaluated and e.published is not None]
+            mark = min(pending) if pending else max(done) if done else None
+            if mark is not None and (watermark is None or mark > watermark):
+                watermark = watermarks[url] = mark
+                # entries below the watermark no longer need to be
+                # remembered
+                for key, (seen_url, published) in list(seen.items()):
+                    if (seen_url == url and published is not None and
+                            published < watermark):
+                        del seen[key]
+                self.writes.add(
+                    'delete from seen where cfg_name=? and url=? and '
+                    'published<?', (cfg_name, url, watermark))
+                self.writes.add(
+                    'insert or replace into watermarks (cfg_name, url, '
+                    'published) values (?, ?, ?)', (cfg_name, url, watermark))
+
+            for e in entries:
+                if e.guid in evaluated and (
+                        watermark is None or e.published is None or
+                        e.published >= watermark):
+                    seen[e.guid] = (url, e.published)
+                    self.writes.add(
+                        'insert or replace into seen (cfg_name, guid, url, '
+                        'published) values (?, ?, ?, ?)',
+                        (cfg_name, e.guid, url, e.published))
+
+    def invalidate(self, cfg_name):
+        # reload the show from the database next time, eg. after another
+        # worker has looked after it
+        self._shows.pop(cfg_name, None)
+
+    def forget(self, cfg_name):
+        # nothing seen any more, without waiting for the database
+        self._shows[cfg_name] = [{}, {}]
+        self.writes.add('delete from seen where cfg_name=?', (cfg_name,))
+        self.writes.add('delete from watermarks where cfg_name=?',
+                        (cfg_name,))
+
+
+class EpisodeIndex(object):
+    # In-memory set of the (season, episode) pairs recorded for each show,
+    # and of the infohashes recorded for all shows, including those still
+    # waiting in the outbox and those archived to the history. A show's set
+    # is loaded from the database the first time it is needed and kept up
+    # to date by whoever changes the shows table afterwards.
+    def __init__(self, db):
+        self.db = db
+        self._shows = {}
+        self._infohashes = None
+        # the last shows rowid and outbox id whose infohashes are loaded
+        self._marks = (0, 0)
+
+    def _episodes(self, cfg_name):
+        try:
+            return self._shows[cfg_name]
+        except KeyError:
+            c = self.db.cursor()
+            c.execute('select season, episode from shows where cfg_name=? '
+                      'union select season, episode from outbox '
+                      'where cfg_name=? '
+                      'union select season, episode from history '
+                      'where cfg_name=?', (cfg_name,) * 3)
+            episodes = self._shows[cfg_name] = set(c.fetchall())
+            return episodes
+
+    def _load_infohashes(self, shows_after, outbox_after):
+        # infohashes of the shows and outbox rows added since the marks
+        c = self.db.cursor()
+        c.execute('select (select max(rowid) from shows), '
+                  '(select max(id) from outbox)')
+        shows_mark, outbox_mark = c.fetchone()
+        c.execute('select infohash from shows where rowid>? and '
+                  'infohash is not null union select infohash from outbox '
+                  'where id>?', (shows_after, outbox_after))
+        infohashes = set(infohash for infohash, in c)
+        self._marks = (shows_mark or 0, outbox_mark or 0)
+        return infohashes
+
+    def _all_infohashes(self):
+        if self._infohashes is None:
+            c = self.db.cursor()
+            c.execute('select infohash from history '
+                      'where infohash is not null')
+            self._infohashes = (set(infohash for infohash, in c) |
+                                self._load_infohashes(0, 0))
+        return self._infohashes
+
+    def contains(self, cfg_name, season, episode):
+        return (season, episode) in self._episodes(cfg_name)
+
+    def has_infohash(self, infohash):
+        return infohash in self._all_infohashes()
+
+    def add(self, cfg_name, season, episode, infohash=None):
+        self._episodes(cfg_name).add((season, episode))
+        if infohash:
+            self._all_infohashes().add(infohash)
+
+    def discard(self, cfg_name, season, episode, infohash=None):
+        self._episodes(cfg_name).discard((season, episode))
+        if infohash:
+            self._all_infohashes().discard(infohash)
+
+    def forget(self, cfg_name):
+        # the show's infohashes may be gone as well, so reload them too
+        self._shows.pop(cfg_name, None)
+        self._infohashes = None
+
+    def refresh(self):
+        # adds the infohashes other workers have recorded since they were
+        # loaded; archived ones were in the shows table first
+        if self._infohashes is not None:
+            self._infohashes |= self._load_infohashes(*self._marks)
+
+
+class Leases(object):
+    # Shows claimed by one of several worker processes sharing the database.
+    # Only the worker holding a show's lease may check the show or its
+    # torrents. Leases last ttl seconds and are renewed by heartbeat(), so
+    # the shows of a worker that dies move to the others once its leases
+    # expire. Each worker takes up to its fair share of the shows, given the
+    # number of live workers, and gives up any above it so that workers that
+    # join later get some too.
+    def __init__(self, db, owner, ttl):
+        self.db = db
+        self.owner = owner
+        self.ttl = ttl
+        self._held = set()
+        self._expires = 0
+
+    def holds(self, cfg_name):
+        # only as long as the lease hasn't run out, even if the heartbeat is
+        # late
+        return cfg_name in self._held and time.time() < self._expires
+
+    def __len__(self):
+        return len(self._held)
+
+    def due(self):
+        # whether a third of the lease time has passed since the leases
+        # were last renewed
+        return time.time() >= self._expires - self.ttl * 2 / 3
+
+    def heartbeat(self, cfg_names, keep=()):
+        # Renews our leases and rebalances them over the given shows. Shows
+        # in keep are not given up unless they are no longer among them.
+        # Returns the sets of shows gained and lost.
+        now = time.time()
+        expires = now + self.ttl
+        # the whole exchange is one transaction, so workers take turns
+        with self.db:
+            c = self.db.cursor()
+            c.execute('insert or replace into workers (owner, expires) '
+                      'values (?, ?)', (self.owner, expires))
+            c.execute('delete from workers where expires<?', (now,))
+            c.execute('update leases set expires=?, heartbeat=? '
+                      'where owner=?', (expires, now, self.owner))
+            c.execute('select cfg_name from leases where owner=?',
+                      (self.owner,))
+            held = set(cfg_name for cfg_name, in c)
+            wanted = set(cfg_names)
+            c.execute('select count(*) from workers')
+            share = -(-len(wanted) // max(c.fetchone()[0], 1))
+
+            release = held - wanted
+            extra = sorted(held & wanted - set(keep))
+            release.update(extra[:max(0, len(held & wanted) - share)])
+            c.executemany('delete from leases where cfg_name=? and owner=?',
+                          [(cfg_name, self.owner) for cfg_name in release])
+            held -= release
+
+            c.execute('select cfg_name from leases where expires>?', (now,))
+            free = sorted(wanted - set(cfg_name for cfg_name, in c))
+            for cfg_name in free[:max(0, share - len(held))]:
+                # expired leases are taken over, as long as nobody else got
+                # there first
+                c.execute('delete from leases where cfg_name=? and '
+                          'expires<=?', (cfg_name, now))
+                c.execute('insert or ignore into leases (cfg_name, owner, '
+                          'expires, heartbeat) values (?, ?, ?, ?)',
+                          (cfg_name, self.owner, expires, now))
+                if c.rowcount:
+                    held.add(cfg_name)
+
+        gained, lost = held - self._held, self._held - held
+        self._held, self._expires = held, expires
+        return gained, lost
+
+    def renew(self):
+        # Extends our leases without rebalancing them, in the middle of a
+        # cycle. Returns the shows that another worker has taken over in
+        # the meantime, which are given up.
+        now = time.time()
+        expires = now + self.ttl
+        with self.db:
+            c = self.db.cursor()
+            c.execute('update workers set expires=? where owner=?',
+                      (expires, self.owner))
+            c.execute('update leases set expires=?, heartbeat=? '
+                      'where owner=?', (expires, now, self.owner))
+            c.execute('select cfg_name from leases where owner=?',
+                      (self.owner,))
+            held = self._held & set(cfg_name for cfg_name, in c)
+        lost = self._held - held
+        self._held, self._expires = held, expires
+        return lost
+
+    def release(self):
+        # gives up every lease, so that the other workers can take over
+        # right away
+        with self.db:
+            self.db.execute('delete from leases where owner=?', (self.owner,))
+            self.db.execute('delete from workers where owner=?',
+                            (self.owner,))
+        self._held = set()
+
 
 class TvFetch(object):
 
     def __init__(self, configfile):
         # load config
-        try:
-            self.config = Config(configfile)
-        except configparser.Error as e:
-            raise UserError('Could not parse config file: %s' % e)
+        self.configfile = configfile
+        self.reload_requested = False
+        self._wakeup = None
+        # torrent-done notifications, see run_daemon
+        self._listener = None
+        self.notify_path = None
+        self.load_config()
 
         # setup logging
         log.setLevel(logging.INFO)
@@ -141,29 +1805,106 @@ class TvFetch(object):
         log.setLevel(log_level)
 
         log.info('Running {}'.format(NAME))
-        # TVDB API
+        self.tvdb_lang = self.config.get('tvdb', 'language', 'en')
+        self.db_path = self.config.get('daemon', 'db_path', DEFAULT_DB_PATH)
+        self.pidfile = None
+        # set in worker mode, see run_workers
+        self.leases = None
+        self.workers = {}
+        # {cfg_name: count} from the resets table, see _check_resets
+        self._resets = None
+        self.metrics = Metrics()
+        self.http = HTTPPool()
+        self.stats_file = self.config.get(
+            'daemon', 'stats_file',
+            os.path.join(os.path.dirname(self.db_path), 'stats.txt'))
+
+    # The database, clients and worker pools are only set up once something
+    # needs them, so that commands like --reset-show start quickly.
+
+    @functools.cached_property
+    def tvdb(self):
         tvdb_api_key = self.config.get('tvdb', 'api_key')
         if not tvdb_api_key:
             raise UserError("You must set the api_key setting in the "
                             "[tvdb] section. Get an API key at "
                             "http://thetvdb.com/")
-        self.tvdb = tvdb_api.TVDB(tvdb_api_key)
-        self.tvdb_lang = self.config.get('tvdb', 'language', 'en')
+        return tvdb_api.TVDB(tvdb_api_key)
 
+    @functools.cached_property
+    def db(self):
         # setup database if needed
-        db_dir = os.path.dirname(DEFAULT_DB_PATH)
-        if not os.path.exists(db_dir):
-            os.makedirs(db_dir, 0o770)
-        db_path = self.config.get('daemon', 'db_path', DEFAULT_DB_PATH)
-        db_exists = os.path.exists(db_path)
-        self.db = sqlite3.connect(db_path)
-        if not db_exists:
-            c = self.db.cursor()
-            c.execute(
-                'create table shows(name text, season integer, '
-                'episode integer, title text, status text, url text, '
-                'transid integer, cfg_name text)')
-            log.debug('Created initial database')
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, 0o770, exist_ok=True)
+        # wait for other workers to finish writing, rather than failing
+        db = sqlite3.connect(
+            self.db_path,
+            timeout=float(self.config.get('daemon', 'db_timeout', 30)))
+        db.execute('PRAGMA journal_mode=WAL')
+        self._migrate(db)
+        return db
+
+    @functools.cached_property
+    def writes(self):
+        # changes are written once per cycle, see UnitOfWork
+        return UnitOfWork(self.db)
+
+    @functools.cached_property
+    def episodes(self):
+        return EpisodeIndex(self.db)
+
+    @functools.cached_property
+    def seen(self):
+        return SeenEntries(self.db, self.writes)
+
+    @functools.cached_property
+    def torrents(self):
+        # downloaded .torrent files are cached next to the database
+        cache_dir = self.config.get(
+            'daemon', 'cache_dir',
+            os.path.join(os.path.dirname(self.db_path), 'torrents'))
+        cache_size = float(
+            self.config.get('daemon', 'torrent_cache_size', 100)) * 1048576
+        return TorrentFetcher(
+            TorrentCache(cache_dir, cache_size),
+            int(self.config.get('daemon', 'torrent_workers', 4)),
+            self.http, self.metrics)
+
+    @functools.cached_property
+    def placer(self):
+        return FilePlacer(
+            int(self.config.get('daemon', 'placement_workers', 2)),
+            self.metrics)
+
+    @functools.cached_property
+    def cleaner(self):
+        # deletes the files of finished torrents
+        return ThreadPoolExecutor(max_workers=1)
+
+    def _migrate(self, db):
+        # Bring the database schema up to date, one version at a time. The
+        # version is read with the write lock held, in case other workers
+        # are starting up at the same time.
+        c = db.cursor()
+        while True:
+            c.execute('BEGIN IMMEDIATE')
+            c.execute('PRAGMA user_version')
+            version = c.fetchone()[0]
+            if version >= len(MIGRATIONS):
+                db.rollback()
+                return
+            # semicolons inside triggers don't end the statement
+            statement = ''
+            for part in MIGRATIONS[version].split(';'):
+                statement += part + ';'
+                if sqlite3.complete_statement(statement):
+                    if statement.strip(' ;'):
+                        c.execute(statement)
+                    statement = ''
+            c.execute('PRAGMA user_version=%d' % (version + 1))
+            db.commit()
+            log.debug('Migrated database to version %d' % (version + 1))
 
     @property
     def transmission(self):
@@ -172,287 +1913,845 @@ class TvFetch(object):
                 'host': 'localhost',
                 'port': '9091',
                 'user': None,
-                'password': None
+                'password': None,
+                'timeout': '30',
             })
 
-            trans_cfg['address'] = trans_cfg.pop('host')
-
-            self._transmission_client = transmissionrpc.Client(**trans_cfg)
+            # the rest of the section is tvfetch's own settings
+            self._transmission_client = transmissionrpc.Client(
+                address=trans_cfg['host'], port=trans_cfg['port'],
+                user=trans_cfg['user'], password=trans_cfg['password'],
+                timeout=float(trans_cfg['timeout']))
 
         return self._transmission_client
 
-    def find_new(self):
-        # find our shows
-        builtins = ('daemon', 'transmission', 'defaults', 'tvdb')
-        shows = [s for s in self.config.sections() if s not in builtins]
-        defaults = self.config.items('defaults', SHOW_DEFAULTS)
-
+    def load_config(self):
+        # Reads the config file and compiles the show settings. Both are
+        # swapped in together, and only once the whole file has loaded.
+        try:
+            mtime = os.stat(self.configfile).st_mtime
+        except OSError:
+            mtime = None
+        try:
+            config = Config(self.configfile)
+        except configparser.Error as e:
+            raise UserError('Could not parse config file: %s' % e)
+        self.config, self.shows, self.config_mtime = (
+            config, config.shows(), mtime)
+
+    def reload_config(self):
+        # Reloads the config if it was changed or a reload was requested
+        # with SIGHUP. Returns True if it was reloaded. Settings that are
+        # only read at startup (database, workers, logging, transmission)
+        # still need a restart.
+        try:
+            mtime = os.stat(self.configfile).st_mtime
+        except OSError:
+            mtime = None
+        if not self.reload_requested and mtime == self.config_mtime:
+            return False
+        self.reload_requested = False
+        shows = self.shows
+        try:
+            self.load_config()
+        except UserError as e:
+            # keep running with the old settings
+            log.error('Could not reload config: %s' % e)
+            self.config_mtime = mtime
+            return False
+        log.info('Reloaded config from %s' % self.configfile)
+        self._settings_changed(shows)
+        return True
+
+    def _settings_changed(self, old_shows):
+        # Looks at every feed entry of the shows whose LOOKUP_SETTINGS have
+        # changed again, and reloads them from tvdb
+        for cfg_name, show in self.shows.items():
+            old = old_shows.get(cfg_name)
+            if old is None:
+                continue
+            changed = [key for key in LOOKUP_SETTINGS
+                       if getattr(old, key) != getattr(show, key)]
+            if not changed:
+                continue
+            log.info('Settings of "%s" changed (%s), checking it again' % (
+                cfg_name, ', '.join(changed)))
+            self.seen.forget(cfg_name)
+            self.writes.add('UPDATE tvdb SET stale=1 WHERE cfg_name=?',
+                            (cfg_name,))
+            if 'exclude_extensions' in changed:
+                self.writes.add(
+                    'DELETE FROM rejected WHERE cfg_name=? AND reason=?',
+                    (cfg_name, 'excluded extension'))
+        self.writes.flush()
+
+    def show_sections(self):
+        return self.config.show_sections()
+
+    @functools.cached_property
+    def breaker(self):
+        return CircuitBreaker(
+            'Transmission',
+            int(self.config.get('transmission', 'max_failures', 3)),
+            float(self.config.get('transmission', 'retry_interval', 30)))
+
+    def _rpc(self, method, *args, **kwargs):
+        # Calls a transmission client method, timing it. Raises
+        # TransmissionUnavailable if transmission can't be reached, or
+        # right away while it is known to be down.
+        if not self.breaker.allow():
+            raise TransmissionUnavailable(
+                'Transmission is unavailable, not calling %s' % method)
+        with self.metrics.phase('transmission', method=method):
+            try:
+                result = getattr(self.transmission, method)(*args, **kwargs)
+            except transmissionrpc.error.TransmissionError as e:
+                # errors from transmission itself have no original error
+                if e.original is None:
+                    self.breaker.success()
+                    raise
+                error = e
+            except OSError as e:
+                error = e
+            else:
+                self.breaker.success()
+                return result
+        log.warning('Could not reach transmission: %s' % error)
+        self.breaker.failure()
+        raise TransmissionUnavailable(str(error))
+
+    def find_new(self, shows=None):
+        # Checks the given show sections (all of them by default) for new
+        # episodes. Returns {cfg_name: ok}, where ok is False for shows that
+        # could not be looked up or whose feeds returned nothing.
+        if shows is None:
+            shows = self.show_sections()
+        self._check_resets()
+        shows = [cfg_name for cfg_name in shows if self._holds(cfg_name)]
+        with self.metrics.cycle('find_new'):
+            try:
+                return self._find_new(shows)
+            finally:
+                # whatever was done so far still needs to be recorded
+                self.writes.flush()
+
+    def _check_resets(self):
+        # Drops the episodes and seen entries cached for shows that have
+        # been reset since the last check, by this or another process (see
+        # reset_show)
+        c = self.db.cursor()
+        c.execute('SELECT cfg_name, count FROM resets')
+        resets = dict(c)
+        if self._resets is not None:
+            for cfg_name, count in resets.items():
+                if count != self._resets.get(cfg_name):
+                    log.info('Show "%s" was reset' % cfg_name)
+                    self.episodes.forget(cfg_name)
+                    self.seen.invalidate(cfg_name)
+        self._resets = resets
+
+    def _find_new(self, shows):
+        # Look up each show first, then fetch all of the season feeds
+        # concurrently. Shows are still processed one at a time, in config
+        # order, as soon as their own feeds have arrived.
+        results = {}
+        lookups = []
         for cfg_name in shows:
-            show = self.config.items(cfg_name, defaults)
-            show['name'] = show.get('name', cfg_name)
-            show['feed_search'] = show.get('feed_search', show['name'])
-            log.debug('Looking up %s' % show['feed_search'])
-
-            # if we're at downloading max_concurrent episodes, then stop
-            # processing this show
-            max_concurrent = int(show.get('max_concurrent'))
-            c = self.db.cursor()
-            c.execute(
-                'select count(*) from shows where cfg_name=? and status=?',
-                (cfg_name, STATUS_INCOMPLETE)
-            )
-            count = c.fetchone()[0]
-            if count >= max_concurrent:
-                log.debug(
-                    'Reached maximum concurrent torrents (%d) for "%s".' % (
-                        max_concurrent, cfg_name)
-                )
+            self._extend_leases()
+            if not self._holds(cfg_name):
                 continue
+            try:
+                lookup = self._lookup_show(cfg_name)
+            except (ShowError, tvdb_error.PytvdbapiError) as e:
+                log.error(e)
+                results[cfg_name] = False
+                continue
+            results[cfg_name] = True
+            if lookup is not None:
+                lookups.append(lookup)
+
+        # Each season feed is requested from the show's first feed source,
+        # and from the next ones too if that is slow or fails (see
+        # HedgedRequest). Whichever sources answer are merged. Every source
+        # has its own workers, so a slow one doesn't hold up the others.
+        feed_workers = int(self.config.get('daemon', 'feed_workers', 4))
+        hedge_delay = float(self.config.get('daemon', 'hedge_delay', 5))
+        executors = collections.defaultdict(
+            lambda: ThreadPoolExecutor(max_workers=feed_workers))
+        jobs = []
+        try:
+            for cfg_name, show, tvdb_show, count, feed_urls in lookups:
+                requests = []
+                for season, urls in feed_urls:
+                    # entries older than these have all been dealt with
+                    since = dict((url, self.seen.watermark(cfg_name, url))
+                                 for url in urls.values())
+                    cached = dict((url, self._cached_feed(url, since[url]))
+                                  for url in urls.values())
+                    fetch = functools.partial(
+                        self._fetch_source, cfg_name, urls, cached, since)
+                    request = HedgedRequest(
+                        executors, fetch, show.feed_sources, hedge_delay)
+                    requests.append((season, urls, cached, request))
+                jobs.append((cfg_name, show, tvdb_show, count, requests))
+
+            for cfg_name, show, tvdb_show, count, requests in jobs:
+                feeds = []
+                for season, urls, cached, request in requests:
+                    sources = []
+                    for source, feed in request.results():
+                        url = urls[source.name]
+                        sources.append((source, url, self._feed_entries(
+                            url, cached[url], feed)))
+                    feeds.append((season, sources))
+                # the feeds may have taken a while, and another worker may
+                # have the show by now
+                self._extend_leases()
+                if not self._holds(cfg_name):
+                    continue
+                results[cfg_name] = self._add_episodes(
+                    cfg_name, show, tvdb_show, count, feeds)
+        finally:
+            # don't wait for sources that were too slow to be used
+            for cfg_name, show, tvdb_show, count, requests in jobs:
+                for season, urls, cached, request in requests:
+                    request.cancel()
+            for executor in executors.values():
+                executor.shutdown(wait=False)
+
+        self.torrents.cache.evict()
+        return results
+
+    def _cached_feed(self, url, since):
+        c = self.db.cursor()
+        c.execute('select etag, modified, entries, since from feeds '
+                  'where url=?', (url,))
+        row = c.fetchone()
+        etag, modified, entries, cached_since = row or (None,) * 4
+        # Entries older than the watermark the feed was read with are left
+        # out of the cached copy. They are needed again if the watermark has
+        # moved back since (see SeenEntries.forget), so read it all again.
+        if row is None or (cached_since is not None and (
+                since is None or since < cached_since)):
+            return {'etag': None, 'modified': None, 'entries': None}
+        return {'etag': etag, 'modified': modified,
+                'entries': json.loads(entries)}
+
+    def _fetch_source(self, cfg_name, urls, cached, since, source):
+        # fetches a season feed from one source for a HedgedRequest
+        url = urls[source.name]
+        feed = self._fetch_feed(cfg_name, url, cached[url], since[url],
+                                source)
+        return feed if feed.get('status') else None
+
+    def _fetch_feed(self, cfg_name, url, cached, since, source):
+        # Downloads and reads a season feed, revalidating the cached copy.
+        # Returns {'status', 'etag', 'modified', 'entries', 'since'}, with a
+        # 304 status if the cached copy is still current and no status at
+        # all if the download failed. Entries published before since are
+        # left out (see read_feed).
+        headers = {}
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['modified']:
+            headers['If-Modified-Since'] = cached['modified']
+        try:
+            # The feed is parsed as it is downloaded, and the download
+            # stops once the rest of it is older than the watermark.
+            with self.metrics.phase('feed_download', show=cfg_name,
+                                    source=source.name), self.http.stream(
+                    url, headers, timeout=source.timeout) as (
+                    status, response_headers, body):
+                if status == 304:
+                    self.metrics.inc('feeds_not_modified')
+                    return {'status': 304, 'entries': []}
+                # (already counted in the show's time for the download)
+                with self.metrics.phase('feed_parse'):
+                    entries = list(read_feed(body, since,
+                                             source.newest_first))
+        except ElementTree.ParseError as e:
+            # feedparser copes with feeds that aren't quite XML, but needs
+            # the whole of it
+            log.debug('Could not read feed %s (%s), using feedparser' %
+                      (url, e))
+            try:
+                status, response_headers, body = self.http.get(
+                    url, timeout=source.timeout)
+            except (OSError, HTTPException) as e:
+                log.error('Could not download feed %s: %s' % (url, e))
+                self.metrics.inc('errors', phase='feed_download')
+                return {'entries': []}
+            with self.metrics.phase('feed_parse', show=cfg_name):
+                entries, since = feedparser_entries(body), None
+        except (OSError, HTTPException) as e:
+            log.error('Could not download feed %s: %s' % (url, e))
+            self.metrics.inc('errors', phase='feed_download')
+            return {'entries': []}
+        return {'status': status, 'etag': response_headers.get('ETag'),
+                'modified': response_headers.get('Last-Modified'),
+                'entries': entries, 'since': since}
+
+    def _feed_entries(self, url, cached, feed):
+        # The feed hasn't changed since we last parsed it
+        if feed.get('status') == 304 and cached['entries'] is not None:
+            log.debug('feed not modified: %s' % url)
+            return cached['entries']
+
+        entries = feed['entries']
+        # only cache successful responses that can be revalidated later
+        if feed.get('status') == 200 and (feed.get('etag') or
+                                          feed.get('modified')):
+            self.writes.add(
+                'insert or replace into feeds (url, etag, modified, entries, '
+                'since) values (?, ?, ?, ?, ?)',
+                (url, feed.get('etag'), feed.get('modified'),
+                 json.dumps(entries), feed.get('since')))
+        return entries
+
+    def _lookup_show(self, cfg_name):
+        show = self.shows[cfg_name]
+        log.debug('Looking up %s' % show.feed_search)
+
+        # if we're at downloading max_concurrent episodes, then stop
+        # processing this show. Episodes waiting in the outbox count too.
+        # The show's summary has the counts, however long its history.
+        max_concurrent = show.max_concurrent
+        c = self.db.cursor()
+        c.execute(
+            'select (select incomplete from show_summary where cfg_name=?), '
+            '(select last_season from show_summary where cfg_name=?), '
+            '(select count(*) from outbox where cfg_name=?)', (cfg_name,) * 3
+        )
+        incomplete, last_season, waiting = c.fetchone()
+        count = (incomplete or 0) + waiting
+        if count >= max_concurrent:
+            log.debug(
+                'Reached maximum concurrent torrents (%d) for "%s".' % (
+                    max_concurrent, cfg_name)
+            )
+            return None
+
+        # Get the show data from TVDB
+        tvdb_show = self._tvdb_lookup(cfg_name, show)
+
+        # if show has a season 0 (extras), don't count it in the total number
+        # of seasons.
+        num_seasons = len([s for s in tvdb_show['seasons'] if s != 0])
+
+        if num_seasons <= 0:
+            raise ShowError('No seasons found for "%s"' % show.name)
+
+        # Start with the last downloaded season. If no downloads, use
+        # start_season
+        start_season = last_season or show.start_season
+
+        # load torrent feeds one season at a time, since the feed only
+        # returns a max of 30 shows. Returns [(season, {source name: url})]
+        feed_urls = []
+        for season in range(start_season, num_seasons + 1):
+            urls = {}
+            for source in show.feed_sources:
+                urls[source.name] = self._feed_url(show, source, season)
+                log.debug('checking feed url: %s' % urls[source.name])
+            feed_urls.append((season, urls))
+
+        return cfg_name, show, tvdb_show, count, feed_urls
+
+    def _feed_url(self, show, source, season):
+        if source.url is not None:
+            return source.url % {
+                'show_name': quote_plus(show.feed_search),
+                'quality': quote_plus(show.quality or ''),
+                'season': season,
+            }
+        feed_params = {
+            'mode': 'rss',
+            'show_name': show.feed_search,
+            'quality': show.quality,
+            'season': season
+        }
+        if show.feed_search_exact:
+            feed_params['show_name_exact'] = 'true'
+        return feed_url + '?' + urlencode(feed_params)
+
+    def _tvdb_lookup(self, cfg_name, show):
+        # Season/episode structure is cached per show, and only refreshed
+        # from TVDB once the cache_ttl has expired or the entry was
+        # invalidated with --refresh-tvdb.
+        ttl = float(self.config.get('tvdb', 'cache_ttl', 24)) * 3600
+        c = self.db.cursor()
+        c.execute(
+            'select series_id, series_name, seasons, updated, stale '
+            'from tvdb where cfg_name=?', (cfg_name,))
+        row = c.fetchone()
+        cached = None
+        if row is not None:
+            series_id, series_name, seasons, updated, stale = row
+            seasons = json.loads(seasons)
+            cached = {
+                'id': series_id,
+                'name': series_name,
+                'seasons': dict(
+                    (int(s), dict((int(e), t) for e, t in eps.items()))
+                    for s, eps in seasons.items()),
+            }
+            if not stale and time.time() - updated < ttl:
+                return cached
+
+        log.debug('Loading %s from tvdb' % show.name)
+        try:
+            with self.metrics.phase('tvdb', show=cfg_name):
+                if show.tvdb_id:
+                    try:
+                        tvdb_show = self.tvdb.get(
+                            show.tvdb_id, self.tvdb_lang)
+                    except tvdb_error.TVDBIdError:
+                        raise ShowError(
+                            'Show not found on tvdb: %s' % show.tvdb_id)
+                else:
+                    result = self.tvdb.search(show.name, self.tvdb_lang)
+                    if not len(result):
+                        raise ShowError(
+                            'Show not found on tvdb: %s' % show.name)
+
+                    if len(result) > 1:
+                        log.warning(
+                            'Multiple matches found for "{r.search}"'
+                            .format(r=result))
+
+                    tvdb_show = result[0]
+
+                seasons = dict(
+                    (season.season_number,
+                     dict((e.EpisodeNumber, e.EpisodeName) for e in season))
+                    for season in tvdb_show)
+        except tvdb_error.ConnectionError as e:
+            self.metrics.inc('errors', phase='tvdb')
+            if cached is None:
+                raise
+            # an outdated answer is better than none at all
+            log.warning('Could not reach tvdb, using cached data for "%s": '
+                        '%s' % (cfg_name, e))
+            return cached
+
+        info = {'id': tvdb_show.id, 'name': tvdb_show.SeriesName,
+                'seasons': seasons}
+        self.writes.add(
+            'insert or replace into tvdb (cfg_name, series_id, series_name, '
+            'seasons, updated, stale) values (?, ?, ?, ?, ?, 0)',
+            (cfg_name, info['id'], info['name'], json.dumps(seasons),
+             time.time()))
+        return info
 
-            # Get the show data from TVDB
-            if show.get('tvdb_id'):
-                try:
-                    tvdb_show = self.tvdb.get(show['tvdb_id'], self.tvdb_lang)
-                except tvdb_error.TVDBIdError:
-                    result = []
-            else:
-                result = self.tvdb.search(show['name'], self.tvdb_lang)
-                if not len(result):
-                    log.error('Show not found on tvdb: %s' % show['name'])
+    def _add_episodes(self, cfg_name, show, tvdb_show, count, feeds):
+        # Takes [(season, [(source, feed url, feed entries), ...])], with
+        # the sources that answered in order of preference.
+        max_concurrent = show.max_concurrent
+        # guids of the entries we are done with, see SeenEntries
+        evaluated = set()
+        unseen = []  # [(feed url, [FeedEntry, ...])]
+        entries = []
+        # {duplicate entry: the entry kept for the same torrent}
+        duplicates = {}
+        total = 0
+        for season, sources in feeds:
+            parsed = []
+            rank = 0
+            for source, url, feed_entries in sources:
+                log.debug('found %d entries for %s, season %s from %s' %
+                          (len(feed_entries), show.name, season,
+                           source.name))
+                total += len(feed_entries)
+                feed_format = FEED_FORMATS[source.format or show.feed_format]
+
+                # assume that feeds give episodes sorted by seed quality,
+                # and maintain that order, ranking entries from preferred
+                # sources first.
+                ranks = dict((entry_key(e), rank + i)
+                             for i, e in enumerate(feed_entries))
+                rank += len(feed_entries)
+
+                # only look at entries we haven't dealt with on earlier
+                # checks, and parse each of those once
+                feed = [feed_format.parse(e, ranks[entry_key(e)]) for e in
+                        self.seen.unseen(cfg_name, url, feed_entries)]
+                unseen.append((url, feed))
+                parsed += feed
+
+            # the same torrent may be listed by several sources
+            kept = {}
+            for entry in sorted(parsed, key=lambda e: e.rank):
+                if entry.episode is None:
+                    # it won't make more sense on the next check either
+                    log.debug('Skipping %s, could not parse entry'
+                              % entry.link)
+                    evaluated.add(entry.guid)
+                    continue
+                keys = [entry.link]
+                if entry.infohash:
+                    keys.append(entry.infohash)
+                first = next((kept[k] for k in keys if k in kept), None)
+                if first is not None:
+                    duplicates[entry] = first
                     continue
+                for key in keys:
+                    kept[key] = entry
+            parsed = [e for e in parsed
+                      if e.episode is not None and e not in duplicates]
+            if not parsed:
+                continue
 
-                if len(result) > 1:
-                    log.warning('Multiple matches found for "{r.search}"'
-                                .format(r=result))
+            # sort feed entries by episode
+            parsed.sort(key=lambda e: (e.episode, e.rank))
+            entries += parsed
+            log.debug('   Found episodes: {}'.format(
+                str(sorted(set(e.episode for e in parsed)))))
 
-                tvdb_show = result[0]
-            try:
-                # if show has a season 0 (extras), don't count it in the total
-                # number of seasons.
-                tvdb_show[0]
-            except tvdb_error.TVDBIndexError:
-                num_seasons = len(tvdb_show)
-            else:
-                num_seasons = len(tvdb_show) - 1
+        # Work out which entries we might want before downloading anything,
+        # so that their torrents can be fetched in parallel.
+        c = self.db.cursor()
+        c.execute('select url from rejected where cfg_name=?', (cfg_name,))
+        rejected = set(url for url, in c)
+        candidates = []
+        for entry in entries:
+            link = entry.link
+            season = entry.season
+            episode = entry.episode
+            log.debug('Found: %s: Season: %s; Episode: %s; Title: %s' % (
+                entry.show, season, episode, entry.title))
+
+            # skip if less than start_episode. eg, s04e06 would be 406
+            e2n = lambda s, e: s * 100 + e
+            start_ssn = show.start_season
+            start_ep = show.start_episode
+            if (e2n(season, episode) < e2n(start_ssn, start_ep)):
+                log.debug(
+                    'Skipping, s%02de%02d is earlier than start_episode'
+                    % (season, episode))
+                evaluated.add(entry.guid)
+                continue
 
-            if num_seasons <= 0:
-                log.error('No seasons found for "{r.search}"'.format(r=result))
+            # Check and see if we need this episode
+            if self.episodes.contains(cfg_name, season, episode):
+                # already have this one, or are already downloading it.
+                log.debug(
+                    '"%s-%s-%s" has already been downloaded or is currently '
+                    'downloading' % (entry.show, season, episode))
+                evaluated.add(entry.guid)
                 continue
 
-            # Get last downloaded season from the database to see which season
-            # to start with. If no downloads, use start_season
-            c = self.db.cursor()
-            c.execute(
-                'select max(season) from shows where cfg_name=?', (cfg_name,))
-            max = c.fetchone()[0]
-            start_season = max or show['start_season']
-
-            # load torrent feeds one season at a time, since the feed only
-            # returns a max of 30 shows.
-            entries = []
-            for season in range(int(start_season), num_seasons + 1):
-                # load rss feed:
-                feed_params = {
-                    'mode': 'rss',
-                    'show_name': show['feed_search'],
-                    'quality': show.get('quality'),
-                    'season': season
-                }
-                if show.get('feed_search_exact', 'false').lower() != 'false':
-                    feed_params['show_name_exact'] = 'true'
-
-                show_feed_url = feed_url + '?' + urlencode(feed_params)
-                log.debug('checking feed url: %s' % show_feed_url)
-                feed = feedparser.parse(show_feed_url)
-
-                log.debug('found %d entries for %s, season %s' %
-                          (len(feed['entries']), show['name'], season))
-
-                # assume that feed has given episodes sorted by seed quality,
-                # and maintain that order.
-                for i, e in enumerate(feed['entries']):
-                    feed['entries'][i]['ord'] = i
-
-                # sort feed entries by episode
-                def ordkey(ep):
-                    summary = self._parse_summary(ep['summary'])
-                    return summary['episode'] * 100 + ep['ord']
-                entries += sorted(feed['entries'], key=ordkey)
-
-                eps = [self._parse_summary(e['summary'])['episode']
-                       for e in entries]
-                log.debug('   Found episodes: {}'
-                          .format(str([int(s) for s in set(eps)])))
-
-            added = 0
-            for entry in entries:
-                if count >= max_concurrent:
-                    log.info(
-                        'Reached maximum concurrent torrents (%d) for this '
-                        'show "%s".' % (max_concurrent, cfg_name))
-                    break
+            if link in rejected:
+                log.debug('Skipping %s, torrent was rejected before' % link)
+                evaluated.add(entry.guid)
+                continue
 
-                link = entry['link']
-                summary = entry['summary']
+            if entry.infohash and self.episodes.has_infohash(entry.infohash):
+                log.debug('Skipping %s, torrent %s is already known' % (
+                    link, entry.infohash))
+                evaluated.add(entry.guid)
+                continue
 
-                # parse summary details (assuming ezrss keeps this consistent)
-                # ex: 'Show Name: Dexter; Episode Title: My Bad; Season: 5;
-                # Episode: 1'
-                info = self._parse_summary(summary)
-                log.debug(
-                    'Found: %(show_name)s: Season: %(season)s; '
-                    'Episode: %(episode)s; Title: %(title)s' % info
-                )
-
-                season = int(info['season'])
-                episode = int(info['episode'])
-
-                # skip if less than start_episode. eg, s04e06 would be 406
-                e2n = lambda s, e: int(s) * 100 + int(e)
-                start_ssn = show['start_season']
-                start_ep = show['start_episode']
-                if (e2n(season, episode) < e2n(start_ssn, start_ep)):
-                    log.debug(
-                        'Skipping, s%02de%02d is earlier than start_episode'
-                        % (season, episode))
-                    continue
+            candidates.append(entry)
 
-                # Check and see if we need this episode
-                c = self.db.cursor()
-                c.execute(
-                    'SELECT COUNT() FROM shows WHERE cfg_name=? '
-                    'AND season=? AND episode=?', (cfg_name, season, episode)
-                )
-                if c.fetchone()[0] > 0:
-                    # already have this one, or are already downloading it.
-                    log.debug(
-                        '"%(show_name)s-%(season)s-%(episode)s" has already '
-                        'been downloaded or is currently downloading' % info
-                    )
-                    continue
+        # Torrents are downloaded a few entries ahead of the one being
+        # looked at. Episodes added in the meantime are not fetched again.
+        downloads = self.torrents.prefetch(
+            (entry, entry.link) for entry in candidates
+            if not self.episodes.contains(
+                cfg_name, entry.season, entry.episode))
 
-                # Get torrent file so that we can parse info out of it
-                log.debug('Decoding torrent...')
-                try:
-                    request = Request(link)
-                    request.add_header('Accept-encoding', 'gzip')
-                    response = urlopen(request)
-                except HTTPError as e:
-                    log.debug('Could not download torrent: %s, %s' % (link, e))
-                    continue
+        added = 0
+        for entry, result, error in downloads:
+            link = entry.link
+            if count >= max_concurrent:
+                log.info(
+                    'Reached maximum concurrent torrents (%d) for this '
+                    'show "%s".' % (max_concurrent, cfg_name))
+                break
 
-                if response.info().get('Content-Encoding') == 'gzip':
-                    buf = io.BytesIO(response.read())
-                    f = gzip.GzipFile(fileobj=buf)
-                    data = f.read()
-                else:
-                    data = response.read()
+            season = entry.season
+            episode = entry.episode
+            if self.episodes.contains(cfg_name, season, episode):
+                continue
 
-                try:
-                    torrent = bencodepy.decode(data)
-                except DecodingError as e:
-                    log.debug(str(e))
-                    log.error('Could not parse torrent: %s' % link)
-                    continue
+            # Get torrent file so that we can parse info out of it
+            log.debug('Decoding torrent...')
+            if isinstance(error, BencodeError):
+                log.debug(str(error))
+                log.error('Could not parse torrent: %s' % link)
+                self._reject(cfg_name, link, 'invalid torrent')
+                evaluated.add(entry.guid)
+                continue
+            elif isinstance(error, (OSError, HTTPException)):
+                log.debug('Could not download torrent: %s, %s' % (link, error))
+                continue
+            elif error is not None:
+                raise error
+
+            data, torrent = result
+            if self.episodes.has_infohash(torrent.infohash):
+                # the same torrent came in through another feed or show
+                log.debug('Skipping %s, torrent %s is already known' % (
+                    link, torrent.infohash))
+                evaluated.add(entry.guid)
+                continue
 
-                filename = torrent[b'info'].get(b'name').decode()
-                if not filename:
-                    files = torrent[b'info'][b'files']
-                    # get largest file
-                    files = sorted(
-                        files, key=lambda f: f['length'], reverse=True)
-                    filename = files[0]['path']
-
-                ext = os.path.splitext(filename)[1][1:]
-                if ext in show['exclude_extensions'].split(','):
-                    log.debug(
-                        'Skipping %s, file extension blacklisted' % filename)
-                    continue
+            filename = torrent.name
+            if not filename:
+                # get largest file
+                filename = max(torrent.files, key=lambda f: f[1])[0]
 
-                # Add the show
-                added += 1
-                log.info(
-                    'Adding %(show_name)s-%(season)s-%(episode)s to '
-                    'transmission queue' % info)
-                log.debug(link)
-                b64_data = base64.b64encode(data).decode()
+            ext = os.path.splitext(filename)[1][1:]
+            if ext in show.exclude_extensions:
+                log.debug(
+                    'Skipping %s, file extension blacklisted' % filename)
+                self._reject(cfg_name, link, 'excluded extension')
+                evaluated.add(entry.guid)
+                continue
+
+            # Add the show. It waits in the outbox, written at the end of the
+            # cycle, until send_outbox gets it to transmission.
+            added += 1
+            log.info('Adding %s-%s-%s to transmission queue' % (
+                entry.show, season, episode))
+            log.debug(link)
+            show_name = tvdb_show['name']
+            title = tvdb_show['seasons'].get(season, {}).get(episode)
+            if not title:
+                title = entry.title or '(no title)'
+            self.writes.add(
+                'INSERT INTO outbox (cfg_name, name, season, episode, title, '
+                'url, infohash, torrent) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (cfg_name, show_name, season, episode, title, link,
+                 torrent.infohash, data)
+            )
+            self.episodes.add(cfg_name, season, episode, torrent.infohash)
+            evaluated.add(entry.guid)
+            count += 1
+
+        # other entries for episodes we now have are done with, too
+        for entry in candidates:
+            if self.episodes.contains(cfg_name, entry.season, entry.episode):
+                evaluated.add(entry.guid)
+        # and so are duplicates of the entries we are done with
+        for entry, first in duplicates.items():
+            if first.guid in evaluated:
+                evaluated.add(entry.guid)
+        self.seen.update(cfg_name, unseen, evaluated)
+
+        if added == 0:
+            log.info('No new episodes found for %s' % cfg_name)
+        return total > 0
+
+    def _reject(self, cfg_name, url, reason):
+        # remember torrents we don't want, so they are never fetched again
+        self.writes.add(
+            'insert or replace into rejected (url, cfg_name, reason) '
+            'values (?, ?, ?)', (url, cfg_name, reason))
+
+    def send_outbox(self):
+        # Adds the torrents waiting in the outbox to transmission, oldest
+        # first, and records them as downloading. Each batch is written as
+        # it is sent. Stops if transmission is unavailable; the rest are
+        # sent next time. Returns the number of torrents still waiting.
+        batch_size = int(self.config.get('transmission', 'batch_size', 20))
+        c = self.db.cursor()
+        last_id = 0
+        # episodes sent but not written yet
+        sent = set()
+        with self.metrics.cycle('send_outbox'):
+            while True:
+                c.execute(
+                    'SELECT id, cfg_name, name, season, episode, title, url, '
+                    'infohash, torrent FROM outbox WHERE id>? ORDER BY id '
+                    'LIMIT ?', (last_id, batch_size))
+                rows = c.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
                 try:
-                    trans_info = self.transmission.add_torrent(b64_data)
-                except transmissionrpc.error.TransmissionError as e:
-                    if '"duplicate torrent"' in str(e):
-                        log.info('Torrent already exists. Resuming.')
-                        # TODO: Find the duplicate torrent
-                        binfo = bencodepy.encode(torrent[b'info'])
-                        hash = hashlib.sha1(binfo)
-                        trans_info = self.transmission.inf(hash.hexdigest())
-                        self.transmission.start(trans_info.id)
-                    else:
-                        raise
-
-                # Record in db
-                c = self.db.cursor()
-                show_name = tvdb_show.SeriesName
+                    for row in rows:
+                        self._extend_leases()
+                        if not self._holds(row[1]):
+                            continue
+                        episode = row[1], row[3], row[4]
+                        if episode in sent or self._recorded(*episode):
+                            # Queued twice, by workers that both held the
+                            # show, one after the other's lease ran out
+                            log.warning('Dropping duplicate %s-s%02de%02d '
+                                        'from the outbox' % row[2:5])
+                            self.writes.add('DELETE FROM outbox WHERE id=?',
+                                            (row[0],))
+                            continue
+                        self._send(*row)
+                        sent.add(episode)
+                except TransmissionUnavailable as e:
+                    log.debug('Could not send outbox: %s' % e)
+                    break
+                finally:
+                    self.writes.flush()
+            c.execute('SELECT count(*) FROM outbox')
+            pending = c.fetchone()[0]
+        self.metrics.set('outbox_pending', pending)
+        return pending
+
+    def _recorded(self, cfg_name, season, episode):
+        # whether the episode has been sent to transmission already
+        c = self.db.cursor()
+        c.execute('SELECT 1 FROM shows WHERE cfg_name=? AND season=? AND '
+                  'episode=?', (cfg_name, season, episode))
+        return c.fetchone() is not None
+
+    def _send(self, outbox_id, cfg_name, show_name, season, episode, title,
+              url, infohash, data):
+        b64_data = base64.b64encode(data).decode()
+        try:
+            trans_info = self._rpc('add_torrent', b64_data)
+        except transmissionrpc.error.TransmissionError as e:
+            if '"duplicate torrent"' in str(e):
+                # Added before, but we didn't get to record it. Only older
+                # versions of transmission report duplicates as an error.
+                log.info('Torrent already exists. Resuming.')
                 try:
-                    title = tvdb_show[season][episode].EpisodeName
-                except (tvdb_error.TVDBIndexError, KeyError):
-                    title = info.get('title', '(no title)')
-                c.execute(
-                    'INSERT INTO shows (name, season, episode, title, status, '
-                    'url, transid, cfg_name) VALUES (?, ?, ? ,? ,? ,?, ?, ?)',
-                    (show_name, season, episode, title, STATUS_INCOMPLETE,
-                     link, trans_info.id, cfg_name)
-                )
-                self.db.commit()
-                count += 1
-
-            if added == 0:
-                log.info('No new episodes found for %s' % cfg_name)
-
-    def check_progress(self):
+                    trans_info = self._rpc('get_torrent', infohash)
+                except KeyError:
+                    # leave it in the outbox and try again next time
+                    log.error('Could not find the existing torrent for '
+                              '%s-s%02de%02d (%s)' % (show_name, season,
+                                                      episode, infohash))
+                    return
+                self._rpc('start', trans_info.id)
+            else:
+                # transmission won't take it, so don't try it again
+                log.error('Could not add %s-s%02de%02d to transmission: %s' %
+                          (show_name, season, episode, e))
+                self.writes.add('DELETE FROM outbox WHERE id=?',
+                                (outbox_id,))
+                self._reject(cfg_name, url, 'refused by transmission')
+                self.episodes.discard(cfg_name, season, episode, infohash)
+                # the episode is wanted again
+                self.seen.forget(cfg_name)
+                return
+
+        # recorded once, even if another worker got there first
+        self.writes.add(
+            'INSERT OR IGNORE INTO shows (name, season, episode, title, '
+            'status, url, transid, cfg_name, infohash) '
+            'VALUES (?, ?, ? ,? ,? ,?, ?, ?, ?)',
+            (show_name, season, episode, title, STATUS_INCOMPLETE,
+             url, trans_info.id, cfg_name, infohash)
+        )
+        self.writes.add('DELETE FROM outbox WHERE id=?', (outbox_id,))
+        self.metrics.inc('episodes_added', show=cfg_name)
+        log.debug('Sent %s-s%02de%02d to transmission' %
+                  (show_name, season, episode))
+
+    def check_progress(self, transids=None):
+        # Moves tracked torrents along from downloading to seeding to
+        # complete, or only the given ones. Returns the number of torrents
+        # still being tracked, or None if transmission is unavailable.
+        with self.metrics.cycle('check_progress'):
+            try:
+                return self._check_progress(transids)
+            except TransmissionUnavailable as e:
+                # try again on the next check
+                log.debug('Could not check progress: %s' % e)
+                return None
+            finally:
+                self.writes.flush()
+
+    def _check_progress(self, transids):
         log.debug('Checking progress')
 
-        defaults = self.config.items('defaults', SHOW_DEFAULTS)
-
         # Check for removed torrents
         c = self.db.cursor()
         try:
             c.execute(
                 'SELECT name, season, episode, title, status, url, transid, '
-                'cfg_name FROM shows WHERE status=? OR status=?',
-                (STATUS_INCOMPLETE, STATUS_SEEDING)
+                'cfg_name, infohash FROM shows WHERE status IN (?, ?, ?)',
+                (STATUS_INCOMPLETE, STATUS_SEEDING, STATUS_REMOVING)
             )
         except sqlite3.InterfaceError as e:
             # TODO: Not sure why this happens yet, seems random.
             return
-
-        for row in c:
+        # in worker mode, only the torrents of shows this worker holds
+        rows = [row for row in c if self._holds(row[7])]
+        tracked = set(row[6] for row in rows if row[4] == STATUS_INCOMPLETE)
+        # torrents that are done seeding, see _clean_up
+        finished = []
+        if transids is None:
+            statuses = [row[4] for row in rows]
+            self.metrics.set('torrents', statuses.count(STATUS_INCOMPLETE),
+                             status='incomplete')
+            self.metrics.set('torrents', statuses.count(STATUS_SEEDING),
+                             status='seeding')
+        else:
+            rows = [row for row in rows if row[6] in transids]
+        # files of torrents we no longer track aren't wanted any more
+        for transid in self.placer:
+            if transid not in tracked:
+                self.placer.discard(transid)
+        self.metrics.set('placements_pending', len(self.placer))
+        if not rows:
+            return 0
+
+        # Fetch everything we need about all tracked torrents in a single
+        # request, and work from that snapshot for the rest of this check.
+        torrents = self._rpc('get_torrents', [row[6] for row in rows],
+                             arguments=TORRENT_FIELDS)
+        torrents = dict((t.id, t) for t in torrents)
+
+        for row in rows:
             (show_name, season, episode, title, status, url, transid,
-             cfg_name) = row
-            show_cfg = self.config.items(cfg_name, defaults)
-            seed_ratio = float(show_cfg.get('seed_ratio', 1))
-
-            try:
-                torrent = self.transmission.info(transid)[transid]
-            except KeyError:
+             cfg_name, infohash) = row
+            self._extend_leases()
+            if not self._holds(cfg_name):
+                continue
+            # shows removed from the config get the default settings
+            show = self.shows.get(cfg_name) or self.config.show(cfg_name)
+            seed_ratio = show.seed_ratio
+
+            torrent = torrents.get(transid)
+            if torrent is None and status == STATUS_REMOVING:
+                # removed by an earlier check, which didn't get to record it
+                self._completed(transid)
+            elif torrent is None:
                 # Torrent was removed, so remove from our db
-                c2 = self.db.cursor()
-                c2.execute('DELETE FROM shows WHERE transid=?', (transid,))
-                self.db.commit()
+                # transmission reuses ids, so leave older episodes alone
+                self.writes.add(
+                    'DELETE FROM shows WHERE transid=? AND status=?',
+                    (transid, status))
+                self.episodes.discard(cfg_name, season, episode, infohash)
+                # the episode is wanted again, so look at all entries again
+                self.seen.forget(cfg_name)
+                # and its file isn't being saved any more
+                self.placer.discard(transid)
                 log.info('Torrent removed: %s' % url)
             else:
                 download_dir = torrent._fields['downloadDir'].value
+                torrent_files = torrent.files()
+                if status == STATUS_REMOVING:
+                    # transmission couldn't be asked to remove it last time
+                    finished.append((transid, download_dir, [
+                        f['name'] for f in torrent_files.values()]))
+                    continue
                 # otherwise, check the status
+                placed = None
                 if status == STATUS_INCOMPLETE and torrent.progress == 100:
+                    placed = self.placer.done(transid)
+
+                if (status == STATUS_INCOMPLETE and torrent.progress == 100
+                        and placed is None and transid not in self.placer):
                     # The largest file is likely the one we want.
-                    files = torrent.files().values()
+                    files = torrent_files.values()
                     sortkey = lambda f: f['size']
                     files = sorted(files, key=sortkey, reverse=True)
                     file = files[0]['name']
-                    if not show_cfg.get('destination'):
+                    if not show.destination:
                         raise UserError(
                             'destination not found for show "%s"' % cfg_name)
                     # Move the file to its final destination
-                    destination = show_cfg['destination'] % {
+                    destination = show.destination % {
                         'show_name': show_name,
                         'season': season,
                         'episode': episode,
@@ -467,152 +2766,548 @@ class TvFetch(object):
                         if e.errno != errno.EEXIST:
                             raise
                     # if we don't need the file around for seeding, moving is
-                    # faster
-                    if torrent.ratio >= seed_ratio:
-                        shutil.move(
-                            os.path.join(download_dir, file), destination)
-                    else:
-                        shutil.copy(
-                            os.path.join(download_dir, file), destination)
+                    # faster. The file is placed in the background, and the
+                    # torrent stays incomplete until that has finished.
+                    log.debug('Saving %s-s%02de%02d to %s' %
+                              (show_name, season, episode, destination))
+                    self.placer.submit(
+                        transid, os.path.join(download_dir, file),
+                        destination, move=torrent.ratio >= seed_ratio)
+
+                elif placed is not None:
+                    destination, job = placed
+                    if job.exception() is not None:
+                        # try again on the next check
+                        log.error('Could not save %s-s%02de%02d to %s: %s' %
+                                  (show_name, season, episode, destination,
+                                   job.exception()))
+                        continue
 
                     # Make sure torrent is seeding
-                    self.transmission.start(transid)
-                    c2 = self.db.cursor()
-                    c2.execute(
-                        'UPDATE shows SET status=? WHERE transid=?',
-                        (STATUS_SEEDING, transid))
-                    self.db.commit()
+                    self._rpc('start', transid)
+                    self.writes.add(
+                        'UPDATE shows SET status=? WHERE transid=? AND '
+                        'status=?', (STATUS_SEEDING, transid,
+                                     STATUS_INCOMPLETE))
                     status = STATUS_SEEDING
-                    log.info('Saved %s-s%02de%02d to %s' %
-                             (show_name, season, episode, destination))
+                    log.info('Saved %s-s%02de%02d to %s (%s)' %
+                             (show_name, season, episode, destination,
+                              job.result()))
 
                 elif (status == STATUS_INCOMPLETE
+                      and torrent.progress < 100
                       and torrent.status == 'stopped'
-                      and not show_cfg.get('paused')):
+                      and not show.paused):
                     log.info('Resuming %s-s%02de%02d' %
                              (show_name, season, episode))
-                    self.transmission.start(transid)
+                    self._rpc('start', transid)
 
                 if status == STATUS_SEEDING and torrent.ratio >= seed_ratio:
-                    c2 = self.db.cursor()
-                    c2.execute(
-                        'UPDATE shows SET status=? WHERE transid=?',
-                        (STATUS_COMPLETE, transid))
-                    self.db.commit()
+                    self.writes.add(
+                        'UPDATE shows SET status=? WHERE transid=? AND '
+                        'status=?', (STATUS_REMOVING, transid,
+                                     STATUS_SEEDING))
                     log.info('Stopping torrent %s-s%02de%02d' %
                              (show_name, season, episode))
-                    # stop the torrent
-                    self.transmission.stop(transid)
-
-                    # Clean up remaining files
-                    log.debug('Cleaning up...')
-                    files = []
-                    dirs = []
-                    for num, file in torrent.files().items():
-                        file = file['name']
-                        # The file path should be relative, but we'll do this
-                        # to be safe.
-                        if file.startswith('/'):
-                            continue
-                        # also for safetey
-                        file = file.replace(download_dir, '')
-
-                        parts = file.split('/')
-                        _dirs = [d for d in parts[:-1] if d not in dirs]
-                        dirs += _dirs
-                        files.append(parts[-1])
-
-                    for file in files:
-                        log.debug('Deleted %s' % file)
-                        try:
-                            os.remove(os.path.join(download_dir, file))
-                        except OSError as e:
-                            if e.errno != errno.ENOENT:
-                                # if it's alread deleted, we don't care
-                                raise
-
-                    for dir in dirs:
-                        log.debug('Deleted %s' % dir)
-                        if dir:  # safety
-                            shutil.rmtree(os.path.join(download_dir, dir))
-
-                    self.transmission.remove(transid)
+                    finished.append((transid, download_dir, [
+                        f['name'] for f in torrent_files.values()]))
+
+        if finished:
+            self._clean_up(finished)
+        return len(rows)
+
+    def _clean_up(self, finished):
+        # Removes the torrents that are done seeding, given as [(transid,
+        # download dir, [file names])], in a single request. Their files are
+        # deleted by transmission or in the background.
+        # Removing torrents can't be undone, so make sure the episodes are
+        # recorded as being removed first. They are complete once
+        # transmission has removed them; until then, every check tries again.
+        self.writes.flush()
+        delete_data = _flag(
+            self.config.get('transmission', 'delete_local_data', 'false'))
+        self._rpc('remove_torrent', [transid for transid, d, f in finished],
+                  delete_data=delete_data)
+        for transid, download_dir, files in finished:
+            self._completed(transid)
+        if not delete_data:
+            for transid, download_dir, files in finished:
+                self.cleaner.submit(self._remove_files, download_dir, files)
+
+    def _completed(self, transid):
+        self.writes.add(
+            'UPDATE shows SET status=?, completed=? WHERE transid=? AND '
+            'status=?', (STATUS_COMPLETE, time.time(), transid,
+                         STATUS_REMOVING))
+
+    def _remove_files(self, download_dir, files):
+        log.debug('Cleaning up...')
+        with self.metrics.phase('cleanup'):
+            try:
+                remove_torrent_files(download_dir, files)
+            except OSError as e:
+                log.error('Could not clean up %s: %s' % (download_dir, e))
+                self.metrics.inc('errors', phase='cleanup')
 
     def reset_show(self, show):
         # load coonfig
         if show not in self.config.sections():
             raise UserError("Show does not exist: %s" % show)
+        self.writes.add('DELETE FROM history WHERE cfg_name=?', (show,))
+        self.writes.add('DELETE FROM shows WHERE cfg_name=?', (show,))
+        self.writes.add('DELETE FROM show_summary WHERE cfg_name=?', (show,))
+        self.writes.add('DELETE FROM rejected WHERE cfg_name=?', (show,))
+        self.writes.add('DELETE FROM outbox WHERE cfg_name=?', (show,))
+        # tells a running daemon to drop what it has cached about the show
+        self.writes.add(
+            'INSERT OR REPLACE INTO resets (cfg_name, count) VALUES (?, '
+            'coalesce((SELECT count FROM resets WHERE cfg_name=?), 0) + 1)',
+            (show, show))
+        self.seen.forget(show)
+        self.writes.flush()
+        self.episodes.forget(show)
+        log.info('Successfully deleted history for show "%s"' % show)
+
+    def archive(self, days):
+        # Moves episodes that finished more than days ago (or before
+        # completion times were recorded) from the shows table to the
+        # compact history, which is still checked for episodes we have.
+        cutoff = time.time() - days * 86400
         c = self.db.cursor()
-        c.execute('DELETE FROM shows WHERE cfg_name=?', (show,))
+        with self.db:
+            c.execute(
+                'INSERT OR REPLACE INTO history (cfg_name, season, episode, '
+                'infohash, completed) SELECT cfg_name, season, episode, '
+                'infohash, completed FROM shows WHERE status=? AND '
+                '(completed IS NULL OR completed<?)',
+                (STATUS_COMPLETE, cutoff))
+            c.execute(
+                'DELETE FROM shows WHERE status=? AND '
+                '(completed IS NULL OR completed<?)',
+                (STATUS_COMPLETE, cutoff))
+        log.info('Archived %d episodes' % c.rowcount)
+
+    def refresh_tvdb(self, show=None):
+        # flag cached tvdb data as stale so it is reloaded on the next check
+        if show is None:
+            self.db.execute('UPDATE tvdb SET stale=1')
+        elif show not in self.config.sections():
+            raise UserError("Show does not exist: %s" % show)
+        else:
+            self.db.execute('UPDATE tvdb SET stale=1 WHERE cfg_name=?',
+                            (show,))
         self.db.commit()
-        log.info('Successfully deleted history for show "%s"' % show)
+        log.info('Invalidated tvdb cache for %s' % (
+            'all shows' if show is None else 'show "%s"' % show))
 
     def list_languages(self):
         for lang in tvdb_api.languages():
             print('{l.abbreviation}: {l.name}'.format(l=lang))
 
-    def run_daemon(self):
+    def _create_pidfile(self):
         # try to guess a good pidfile location
-        self.pidfile = self.config.get('daemon', 'pid_file', 'auto')
-        if self.pidfile != 'auto':
-            self.pidfile = self.config.get('daemon', 'pid_file')
-        elif os.path.isdir('/run'):
-            self.pidfile = '/run/{}.pid'.format(NAME)
-        elif os.path.isdir('/var/run'):
-            self.pidfile = '/var/run/{}.pid'.format(NAME)
-        else:
-            self.pidfile = '/tmp/{}.pid'.format(NAME)
+        pidfile = self.config.get('daemon', 'pid_file') or 'auto'
+        if pidfile == 'auto':
+            if os.path.isdir('/run'):
+                pidfile = '/run/{}.pid'.format(NAME)
+            elif os.path.isdir('/var/run'):
+                pidfile = '/var/run/{}.pid'.format(NAME)
+            else:
+                pidfile = '/tmp/{}.pid'.format(NAME)
 
         pid = str(os.getpid())
-        if os.path.isfile(self.pidfile):
-            print("already running ({})".format(self.pidfile))
+        if os.path.isfile(pidfile):
+            print("already running ({})".format(pidfile))
             sys.exit()
         else:
-            open(self.pidfile, 'w').write(pid)
+            open(pidfile, 'w').write(pid)
+            self.pidfile = pidfile
 
+    def run_once(self):
+        # A single check of torrent progress and of every show, for running
+        # from cron or a timer instead of as a daemon.
+        self._create_pidfile()
         signal.signal(signal.SIGINT, self.handle_signal)
+        self.check_progress()
+        self.find_new()
+        # torrents that can't be sent now are sent on the next run
+        self.send_outbox()
+        # Files are placed in the background. Wait for them, and record
+        # them, so that the next run doesn't place them again. Progress is
+        # checked in between, which drops the jobs of removed torrents.
+        interval = float(self.config.get('daemon', 'progress_interval', 5))
+        while len(self.placer):
+            running = self.placer.wait(interval)
+            if self.check_progress(set(self.placer)) is None:
+                log.warning('Transmission is unavailable, leaving %d files '
+                            'to be recorded on the next run'
+                            % len(self.placer))
+                break
+            if not running:
+                # the rest can't be recorded yet
+                break
+        self.cleaner.shutdown(wait=True)
+        self.write_stats()
+        self.remove_pidfile()
+
+    def run_workers(self, count):
+        # Runs the daemon as several worker processes sharing the database,
+        # which split the shows between them (see Leases). This process
+        # only looks after the workers, and restarts any that exit.
+        self._create_pidfile()
+        signal.signal(signal.SIGINT, self.handle_signal)
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.handle_reload_signal)
 
-        # time interval to check for new shows, defaults to 30 minutes
-        check_seconds = self.config.get('daemon', 'check_time', 30) * 60
-
-        last_check = None
+        context = multiprocessing.get_context('fork')
         while True:
-            self.check_progress()
-            now = time.time()
-            if last_check is None or (now - last_check) > check_seconds:
-                last_check = now
-                try:
-                    self.find_new()
-                except transmissionrpc.error.TransmissionError as e:
-                    if "Connection refused" in str(e):
-                        log.error("Could not connect to transmission")
-                    else:
-                        raise
+            for number in range(count):
+                process = self.workers.get(number)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None:
+                    log.error('Worker %d exited with code %s, restarting' %
+                              (number, process.exitcode))
+                self.workers[number] = process = context.Process(
+                    target=self._run_worker, args=(number,),
+                    name='%s-worker-%d' % (NAME, number))
+                process.start()
+            if self.reload_requested:
+                self.reload_requested = False
+                for process in self.workers.values():
+                    os.kill(process.pid, signal.SIGHUP)
             time.sleep(5)
 
+    def _run_worker(self, number):
+        # the worker processes' main function; the workers (and the
+        # pidfile) belong to the parent
+        self.workers = {}
+        self.pidfile = None
+        try:
+            self.run_daemon(worker=number)
+        except UserError as e:
+            log.error(e)
+            sys.exit(1)
+        except Exception as e:
+            log.exception(e)
+            sys.exit(1)
+
+    def run_daemon(self, worker=None):
+        # worker is this process's number when it is one of the worker
+        # processes started by run_workers
+        if worker is None:
+            self._create_pidfile()
+            metrics_port_offset = 0
+            next_heartbeat = float('inf')
+        else:
+            # every worker has its own stats file and metrics port
+            self.stats_file = '%s.%d' % (self.stats_file, worker)
+            metrics_port_offset = worker
+            self.leases = Leases(
+                self.db, '%s:%d' % (socket.gethostname(), os.getpid()),
+                float(self.config.get('daemon', 'lease_time', 120)))
+            next_heartbeat = 0
+
+        # workers are stopped by their parent, even on ctrl-c
+        signal.signal(signal.SIGINT, self.handle_signal
+                      if worker is None else signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.handle_reload_signal)
+            # signals interrupt _sleep, so a reload happens right away
+            self._wakeup, wakeup_w = os.pipe()
+            os.set_blocking(wakeup_w, False)
+            signal.set_wakeup_fd(wakeup_w)
+
+        metrics_port = self.config.get('daemon', 'metrics_port')
+        if metrics_port:
+            self.serve_metrics(
+                self.config.get('daemon', 'metrics_address', '127.0.0.1'),
+                int(metrics_port) + metrics_port_offset)
+
+        # Each show is checked on its own schedule. Torrent progress is polled
+        # often while there are torrents to look after, and rarely otherwise.
+        progress_interval = float(
+            self.config.get('daemon', 'progress_interval', 5))
+        active_interval = progress_interval
+        idle_interval = float(
+            self.config.get('daemon', 'idle_progress_interval', 60))
+        notify_path = self.config.get('daemon', 'notify_socket')
+        if notify_path:
+            # Transmission tells us when torrents are done (--notify-done),
+            # and only those are checked right away. Polling everything is
+            # left to catch up on anything missed, and on seed ratios.
+            if worker is not None:
+                notify_path = '%s.%d' % (notify_path, worker)
+            self._listen(notify_path)
+            active_interval = idle_interval = float(
+                self.config.get('daemon', 'reconcile_interval', 300))
+        self.scheduler = Scheduler(
+            jitter=float(self.config.get('daemon', 'check_jitter', 0.1)),
+            max_backoff=float(
+                self.config.get('daemon', 'max_backoff', 360)) * 60)
+        self.scheduler.sync(self._check_intervals())
+
+        # rendering the metrics takes a while with many shows, so the stats
+        # file is only saved now and then
+        stats_interval = float(
+            self.config.get('daemon', 'stats_interval', 60))
+        next_stats = 0
+        next_progress = 0
+        # torrents reported done, and when to check on files being placed
+        notified = set()
+        next_placement = float('inf')
+        while True:
+            # pick up config changes; show settings and check times apply
+            # from here on
+            if self.reload_config():
+                self.scheduler.sync(self._check_intervals())
+
+            if time.time() >= next_heartbeat:
+                if self._renew_leases():
+                    self.scheduler.sync(self._check_intervals())
+                next_heartbeat = time.time() + self.leases.ttl / 3
+
+            if time.time() >= next_progress:
+                # including torrents left over while transmission was down
+                self.send_outbox()
+                active = self.check_progress()
+                next_progress = time.time() + (
+                    active_interval if active else idle_interval)
+                notified = set()
+            elif notified or time.time() >= next_placement:
+                self.check_progress(notified | set(self.placer))
+                notified = set()
+            next_placement = (time.time() + progress_interval
+                              if len(self.placer) else float('inf'))
+
+            due = self.scheduler.due(time.time())
+            if due:
+                results = self.find_new(due)
+                self.send_outbox()
+                for cfg_name in due:
+                    self.scheduler.done(cfg_name, results.get(cfg_name, False))
+                # look after any newly added torrents soon
+                next_progress = min(next_progress,
+                                    time.time() + active_interval)
+
+            if time.time() >= next_stats:
+                self.write_stats()
+                next_stats = time.time() + stats_interval
+            wake = min(next_progress, next_heartbeat, next_placement,
+                       self.scheduler.next_deadline())
+            notified = self._sleep(max(0, wake - time.time()))
+
         os.unlink(self.pidfile)
 
+    def _listen(self, path):
+        # unix socket that --notify-done sends the ids of finished torrents
+        # to; a leftover one from an earlier run is replaced
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(16)
+        listener.setblocking(False)
+        self._listener, self.notify_path = listener, path
+        log.info('Listening for finished torrents at %s' % path)
+
+    def _read_notifications(self):
+        # the torrent ids sent to the listener, one per line
+        transids = set()
+        while True:
+            try:
+                conn, address = self._listener.accept()
+            except BlockingIOError:
+                return transids
+            data = b''
+            with conn:
+                conn.settimeout(1)
+                try:
+                    while len(data) < 1024:
+                        chunk = conn.recv(1024)
+                        if not chunk:
+                            break
+                        data += chunk
+                except OSError as e:
+                    log.debug('Could not read notification: %s' % e)
+            for line in data.split():
+                try:
+                    transids.add(int(line))
+                except ValueError:
+                    log.debug('Ignoring notification %r' % line)
+            log.debug('Torrents done: %s' % sorted(transids))
+
+    def notify_done(self, transid):
+        # Tells the daemon (each worker, when there are several) that a
+        # torrent has finished downloading. Run by transmission when a
+        # torrent is done.
+        path = self.config.get('daemon', 'notify_socket')
+        if not path:
+            raise UserError('Set notify_socket in the [daemon] section to '
+                            'use --notify-done')
+        paths = [path] + sorted(
+            p for p in glob.glob(glob.escape(path) + '.*')
+            if p.rsplit('.', 1)[1].isdigit())
+        sent = 0
+        for path in paths:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                client.settimeout(5)
+                client.connect(path)
+                client.sendall(b'%d\n' % transid)
+                sent += 1
+            except OSError as e:
+                log.debug('Could not notify %s: %s' % (path, e))
+            finally:
+                client.close()
+        if not sent:
+            raise UserError('Could not reach the daemon at %s'
+                            % self.config.get('daemon', 'notify_socket'))
+
+    def _renew_leases(self):
+        # Heartbeat of a worker process. Returns True if the shows it holds
+        # have changed.
+        # Shows with files still being placed are kept, so that another
+        # worker doesn't place them again.
+        c = self.db.cursor()
+        keep = set()
+        if len(self.placer):
+            c.execute('SELECT transid, cfg_name FROM shows WHERE status=?',
+                      (STATUS_INCOMPLETE,))
+            keep = set(cfg_name for transid, cfg_name in c
+                       if transid in self.placer)
+        # Shows removed from the config are still leased while they have
+        # torrents or outbox rows, so that their torrents are looked after
+        # and sent as they would be by a single process
+        c.execute('SELECT cfg_name FROM shows WHERE status IN (?, ?, ?) '
+                  'UNION SELECT cfg_name FROM outbox',
+                  (STATUS_INCOMPLETE, STATUS_SEEDING, STATUS_REMOVING))
+        wanted = set(self.shows) | set(cfg_name for cfg_name, in c)
+        try:
+            gained, lost = self.leases.heartbeat(wanted, keep)
+        except sqlite3.OperationalError as e:
+            # the leases run out if this keeps failing
+            log.error('Could not renew leases: %s' % e)
+            return False
+        for cfg_name in gained:
+            # other workers may have changed the show since we last had it
+            self.episodes.forget(cfg_name)
+            self.seen.invalidate(cfg_name)
+        self.episodes.refresh()
+        if gained or lost:
+            log.info('Now checking %d shows (%d new, %d given up)' % (
+                len(self.leases), len(gained), len(lost)))
+        return bool(gained or lost)
+
+    def _extend_leases(self):
+        # Renews a worker's leases during a cycle once they are due, so that
+        # they don't run out while it is still busy with its shows
+        if self.leases is None or not self.leases.due():
+            return
+        try:
+            lost = self.leases.renew()
+        except sqlite3.OperationalError as e:
+            log.error('Could not renew leases: %s' % e)
+            return
+        for cfg_name in lost:
+            log.warning('"%s" was taken over by another worker' % cfg_name)
+
+    def _holds(self, cfg_name):
+        # whether this process may check the show; always, unless it is one
+        # of several workers
+        return self.leases is None or self.leases.holds(cfg_name)
+
+    def _sleep(self, seconds):
+        # Sleeps until the timeout, a signal or a torrent-done notification
+        # arrives. Returns the ids of the torrents reported done.
+        waiting = [fd for fd in (self._wakeup, self._listener)
+                   if fd is not None]
+        if not waiting:
+            time.sleep(seconds)
+            return set()
+        ready = select.select(waiting, [], [], seconds)[0]
+        if self._wakeup is not None and self._wakeup in ready:
+            os.read(self._wakeup, 512)
+        if self._listener is not None and self._listener in ready:
+            return self._read_notifications()
+        return set()
+
+    def serve_metrics(self, address, port):
+        server = ThreadingHTTPServer((address, port), MetricsHandler)
+        server.metrics = self.metrics
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        log.info('Serving metrics at http://%s:%d/metrics' % (address, port))
+
+    def write_stats(self):
+        # Saves the current metrics for tvfetch --stats
+        tmp_path = self.stats_file + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('# %s stats at %s\n' % (
+                NAME, time.strftime(DATE_FORMAT)))
+            f.write(self.metrics.render())
+        os.replace(tmp_path, self.stats_file)
+
+    def print_stats(self):
+        # worker processes each save their own stats, see run_daemon
+        paths = [self.stats_file] + sorted(
+            path for path in glob.glob(glob.escape(self.stats_file) + '.*')
+            if path.rsplit('.', 1)[1].isdigit())
+        paths = [path for path in paths if os.path.isfile(path)]
+        if not paths:
+            raise UserError('No stats found at %s. Is the daemon running?'
+                            % self.stats_file)
+        for path in paths:
+            with open(path) as f:
+                print(f.read(), end='')
+
+    def _check_intervals(self):
+        # {cfg_name: seconds between checks} for every show. Shows can set
+        # their own check_time, which defaults to the one in [daemon].
+        return dict((cfg_name, show.check_time)
+                    for cfg_name, show in self.shows.items()
+                    if self._holds(cfg_name))
+
     def handle_signal(self, sig, frame):
         print('\nCaught signal: {}'.format(str(sig)))
         self.shutdown()
 
+    def handle_reload_signal(self, sig, frame):
+        # the config is reloaded at the top of the next daemon loop
+        self.reload_requested = True
+
     def shutdown(self):
         log.info('Shutting down')
-        try:
-            os.unlink(self.pidfile)
-        except FileNotFoundError:
-            pass
+        for process in self.workers.values():
+            process.terminate()
+        for process in self.workers.values():
+            process.join()
+        if self.notify_path:
+            self._listener.close()
+            try:
+                os.unlink(self.notify_path)
+            except FileNotFoundError:
+                pass
+        if self.leases is not None:
+            # this may interrupt a cycle's writes, which are dropped as if
+            # the worker had crashed
+            self.db.rollback()
+            self.leases.release()
+        self.remove_pidfile()
         sys.exit(0)
 
-    def _parse_summary(self, summary):
-        summary_data = dict([i.split(': ') for i in summary.split('; ')])
-        info = {
-            'show_name': summary_data.get('Show Name'),
-            'season': int(summary_data.get('Season')),
-            'episode': int(summary_data.get('Episode')),
-            'title': summary_data.get('Episode Title'),
-        }
-        return info
+    def remove_pidfile(self):
+        if self.pidfile:
+            try:
+                os.unlink(self.pidfile)
+            except FileNotFoundError:
+                pass
+            self.pidfile = None
 
 
 def main():
@@ -623,33 +3318,107 @@ def main():
                         help="Path to configuration file")
     parser.add_argument('--reset-show', action='store', metavar='NAME',
                         help="Delete a show's download history and exit")
+    parser.add_argument('--refresh-tvdb', action='store', metavar='NAME',
+                        nargs='?', const=ALL_SHOWS,
+                        help="Invalidate cached tvdb data for a show (or all "
+                             "shows if no name is given) and exit")
+    parser.add_argument('--archive', action='store', metavar='DAYS',
+                        type=float,
+                        help="Move episodes finished more than DAYS days ago "
+                             "to the download history and exit")
+    parser.add_argument('--stats', action='store_true',
+                        help="Show the running daemon's metrics and exit")
     parser.add_argument('--list-langauges', action='store_true',
                         dest='list_languages',
                         help="Show list of available languages and exit")
+    parser.add_argument('--once', action='store_true',
+                        help="Check torrent progress and all shows once and "
+                             "exit, instead of running as a daemon")
+    parser.add_argument('--notify-done', action='store', metavar='ID',
+                        nargs='?', const=TORRENT_FROM_ENV,
+                        help="Tell the daemon that a torrent has finished "
+                             "downloading and exit. Defaults to the "
+                             "TR_TORRENT_ID transmission sets for its "
+                             "torrent-done script")
+    parser.add_argument('--workers', action='store', metavar='N', type=int,
+                        help="Run the daemon as N worker processes that "
+                             "share the shows between them")
+    parser.add_argument('--profile', action='store', metavar='FILE',
+                        help="Profile the run and save pstats output to FILE")
     options = parser.parse_args()
 
+    if options.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(run, options)
+        finally:
+            profiler.dump_stats(options.profile)
+    else:
+        run(options)
+
+
+def run(options):
+    fetcher = None
     try:
         fetcher = TvFetch(options.config)
         if options.reset_show:
             fetcher.reset_show(options.reset_show)
             sys.exit(0)
 
+        elif options.refresh_tvdb:
+            if options.refresh_tvdb == ALL_SHOWS:
+                fetcher.refresh_tvdb()
+            else:
+                fetcher.refresh_tvdb(options.refresh_tvdb)
+            sys.exit(0)
+
+        elif options.archive is not None:
+            fetcher.archive(options.archive)
+            sys.exit(0)
+
+        elif options.stats:
+            fetcher.print_stats()
+            sys.exit(0)
+
+        elif options.notify_done:
+            transid = options.notify_done
+            if transid is TORRENT_FROM_ENV:
+                transid = os.environ.get('TR_TORRENT_ID')
+                if transid is None:
+                    raise UserError('No torrent id given, and TR_TORRENT_ID '
+                                    'is not set')
+            try:
+                transid = int(transid)
+            except ValueError:
+                raise UserError('Invalid torrent id: %s' % transid)
+            fetcher.notify_done(transid)
+            sys.exit(0)
+
         elif options.list_languages:
             fetcher.list_languages()
             sys.exit(0)
 
-        fetcher.run_daemon()
+        elif options.once:
+            fetcher.run_once()
+            sys.exit(0)
+
+        workers = options.workers or int(
+            fetcher.config.get('daemon', 'workers', 1))
+        if workers > 1:
+            fetcher.run_workers(workers)
+        else:
+            fetcher.run_daemon()
         sys.exit(0)
 
     except UserError as e:
         log.error(e)
+        sys.exit(1)
 
     except Exception as e:
         log.exception(e)
         if fetcher:
-            fetcher.shutdown()
-
-    finally:
+            fetcher.remove_pidfile()
         sys.exit(1)
 
 